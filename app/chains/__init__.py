@@ -1,14 +1,36 @@
 """
 LangChain chains package for the debate bot application.
 Contains all the AI chains for topic analysis, response generation, and validation.
+
+Chain instances are created lazily on first access so importing the package
+does not construct any LLM clients.
 """
 
-from .topic_analysis import topic_analysis_chain
-from .persuasive_response import persuasive_response_chain
-from .consistency_validation import consistency_validation_chain
+from .topic_analysis import TopicAnalysisChain, get_topic_analysis_chain
+from .persuasive_response import PersuasiveResponseChain, get_persuasive_response_chain
+from .consistency_validation import ConsistencyValidationChain, get_consistency_validation_chain
+
+_LAZY_INSTANCES = {
+    "topic_analysis_chain": get_topic_analysis_chain,
+    "persuasive_response_chain": get_persuasive_response_chain,
+    "consistency_validation_chain": get_consistency_validation_chain,
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_INSTANCES:
+        return _LAZY_INSTANCES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
+    "TopicAnalysisChain",
+    "PersuasiveResponseChain",
+    "ConsistencyValidationChain",
+    "get_topic_analysis_chain",
+    "get_persuasive_response_chain",
+    "get_consistency_validation_chain",
     "topic_analysis_chain",
     "persuasive_response_chain",
     "consistency_validation_chain"
-]
\ No newline at end of file
+]
@@ -4,10 +4,27 @@ Validates that generated responses are consistent with the bot's debate stance.
 """
 
 import logging
-from typing import Dict, Any, List
-from langchain.prompts import PromptTemplate
+from functools import cache
+from typing import Dict, Any, List, Optional
+from pydantic import BaseModel, Field
+from langchain_core.caches import InMemoryCache
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from app.config import settings
+from app.chains.llm import get_http_async_client
+from app.chains.prompt_cache import cached_prompt_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ConsistencyResult(BaseModel):
+    """Structured verdict returned by the validator LLM."""
+    is_consistent: bool = Field(description="Whether the response maintains the assigned position")
+    consistency_score: int = Field(description="Overall quality score from 1 to 10")
+    issues: List[str] = Field(description="Issues found in the response")
+    suggestions: List[str] = Field(description="Suggestions for improvement if needed")
+    approved: bool = Field(description="False if the response needs to be regenerated")
 
 
 class ConsistencyValidationChain:
@@ -15,22 +32,29 @@ class ConsistencyValidationChain:
     
     def __init__(self):
         self.llm = ChatOpenAI(
-            model="gpt-4o",
+            model="gpt-4o-mini",  # Classification task, no need for the flagship model
             temperature=0.2,  # Low temperature for consistent validation
             openai_api_key=settings.openai_api_key,
             openai_api_base=settings.openai_base_url,
-            request_timeout=settings.openai_timeout_seconds
+            request_timeout=settings.openai_timeout_seconds,
+            http_async_client=get_http_async_client(),
+            # Validation is near-deterministic and the same (position, response)
+            # pairs recur, so identical prompts are answered from cache
+            cache=InMemoryCache(maxsize=settings.validation_cache_size)
+        )
+        # The schema is enforced server-side, so no JSON cleanup is needed;
+        # include_raw keeps the AIMessage around for usage logging
+        self.structured_llm = self.llm.with_structured_output(
+            ConsistencyResult, method="json_schema", include_raw=True
         )
         
-        self.prompt = PromptTemplate(
-            input_variables=["position", "generated_response", "topic"],
-            template="""
+        # Static instructions first (cacheable prefix), request data last;
+        # the system message is a literal, so only the user template is rendered
+        # per call, and mustache keeps user-supplied braces from being parsed
+        self.prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content="""
 You are validating whether a debate bot's response is consistent with its assigned position.
 
-ASSIGNED POSITION: {position}
-TOPIC: {topic}
-GENERATED RESPONSE: {generated_response}
-
 Evaluate the response on these criteria:
 1. POSITION CONSISTENCY: Does the response maintain the assigned position?
 2. ENGAGEMENT: Is the response engaging for discussion?
@@ -38,18 +62,15 @@ Evaluate the response on these criteria:
 4. APPROPRIATENESS: Is the response respectful and conversational?
 5. LENGTH: Is the response concise (30-80 words)?
 
-Respond with a JSON object:
-{{
-    "is_consistent": true/false,
-    "consistency_score": 1-10,
-    "issues": ["list of any issues found"],
-    "suggestions": ["suggestions for improvement if needed"],
-    "approved": true/false
-}}
-
+Score the response from 1 to 10 and list any issues and suggestions.
 If approved is false, the response needs to be regenerated.
-"""
-        )
+"""),
+            ("user", """
+ASSIGNED POSITION: {{{position}}}
+TOPIC: {{{topic}}}
+GENERATED RESPONSE: {{{generated_response}}}
+""")
+        ], template_format="mustache")
     
     @property
     def input_keys(self) -> list[str]:
@@ -59,83 +80,123 @@ If approved is false, the response needs to be regenerated.
     def output_keys(self) -> list[str]:
         return ["is_consistent", "consistency_score", "issues", "suggestions", "approved"]
     
-    def validate_response(self, bot_response: str, bot_position: str, conversation_history: List[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Validate that bot response maintains consistency with assigned position."""
-        logger = logging.getLogger(__name__)
+    def _format_prompt(self, bot_response: str, bot_position: str) -> List[BaseMessage]:
+        """Format the validation prompt for one response."""
+        logger.info("[CONSISTENCY_VALIDATION] INPUT: bot_response='%s...', bot_position='%s'", bot_response[:100], bot_position)
+        
+        # Prepare inputs for prompt
+        prompt_inputs = {
+            "generated_response": bot_response,
+            "position": bot_position,
+            "topic": ""
+        }
         
+        logger.info("[CONSISTENCY_VALIDATION] PROMPT_INPUTS: %s", prompt_inputs)
+        
+        # Format the prompt
+        formatted_prompt = self.prompt.format_messages(**prompt_inputs)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[CONSISTENCY_VALIDATION] FORMATTED_PROMPT: %s...", formatted_prompt[-1].content[:200])
+        return formatted_prompt
+    
+    def _parse_verdict(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a structured LLM response into the validation output dict."""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[CONSISTENCY_VALIDATION] CACHED_PROMPT_TOKENS: %s", cached_prompt_tokens(response['raw']))
+        if response["parsing_error"] is not None:
+            raise response["parsing_error"]
+        
+        output = response["parsed"].model_dump()
+        
+        logger.info("[CONSISTENCY_VALIDATION] OUTPUT: %s", output)
+        return output
+    
+    def _fallback_output(self, error: Exception) -> Dict[str, Any]:
+        """Validation result used when the validator itself fails."""
+        logger.error("[CONSISTENCY_VALIDATION] ERROR: %s", error)
+        # Fallback validation: don't block on validator outages, but never
+        # approve a response that was not actually checked
+        fallback_output = {
+            "is_consistent": True,
+            "consistency_score": 7,
+            "issues": [],
+            "suggestions": [],
+            "approved": False
+        }
+        logger.info("[CONSISTENCY_VALIDATION] FALLBACK_OUTPUT: %s", fallback_output)
+        return fallback_output
+    
+    async def validate_response(
+        self,
+        bot_response: str,
+        bot_position: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """Validate that bot response maintains consistency with assigned position."""
         try:
-            logger.info(f"[CONSISTENCY_VALIDATION] INPUT: bot_response='{bot_response[:100]}...', bot_position='{bot_position}'")
-            
-            # Format conversation history for context
-            history = conversation_history or []
-            formatted_history = ""
-            
-            if history:
-                logger.info(f"[CONSISTENCY_VALIDATION] HISTORY: {len(history)} messages")
-                for msg in history[-4:]:  # Last 4 messages for context
-                    role = msg.get("role", "unknown")
-                    content = msg.get("message", "")
-                    formatted_history += f"{role.upper()}: {content}\n"
+            formatted_prompt = self._format_prompt(bot_response, bot_position)
             
-            # Prepare inputs for prompt
-            prompt_inputs = {
-                "generated_response": bot_response,
-                "position": bot_position,
-                "topic": ""
-            }
-            
-            logger.info(f"[CONSISTENCY_VALIDATION] PROMPT_INPUTS: {prompt_inputs}")
-            
-            # Format the prompt
-            formatted_prompt = self.prompt.format(**prompt_inputs)
-            logger.debug(f"[CONSISTENCY_VALIDATION] FORMATTED_PROMPT: {formatted_prompt[:200]}...")
-            
-            # Get response from LLM
-            response = self.llm.invoke(formatted_prompt)
-            raw_response = response.content if hasattr(response, 'content') else str(response)
-            logger.info(f"[CONSISTENCY_VALIDATION] LLM_RESPONSE: {raw_response}")
-            
-            # Parse JSON response - handle markdown code blocks
-            import json
-            import re
-            
-            # Strip markdown code blocks if present
-            cleaned_response = raw_response.strip()
-            if cleaned_response.startswith('```json'):
-                # Remove ```json at start and ``` at end
-                cleaned_response = re.sub(r'^```json\s*', '', cleaned_response)
-                cleaned_response = re.sub(r'\s*```$', '', cleaned_response)
-            elif cleaned_response.startswith('```'):
-                # Remove ``` at start and end (generic code blocks)
-                cleaned_response = re.sub(r'^```\s*', '', cleaned_response)
-                cleaned_response = re.sub(r'\s*```$', '', cleaned_response)
-            
-            logger.debug(f"[CONSISTENCY_VALIDATION] CLEANED_RESPONSE: {cleaned_response}")
-            result = json.loads(cleaned_response)
-            
-            output = {
-                "is_consistent": result.get("is_consistent", True),
-                "consistency_score": result.get("consistency_score", 8),
-                "issues": result.get("issues", []),
-                "suggestions": result.get("suggestions", []),
-                "approved": result.get("approved", True)
-            }
-            
-            logger.info(f"[CONSISTENCY_VALIDATION] OUTPUT: {output}")
-            return output
+            # Get structured verdict from LLM
+            response = await self.structured_llm.ainvoke(formatted_prompt)
+            return self._parse_verdict(response)
             
         except Exception as e:
-            logger.error(f"[CONSISTENCY_VALIDATION] ERROR: {str(e)}")
-            # Fallback validation (assume consistent)
-            fallback_output = {
-                "is_consistent": True,
-                "consistency_score": 7,
-                "issues": [],
-                "suggestions": []
-            }
-            logger.info(f"[CONSISTENCY_VALIDATION] FALLBACK_OUTPUT: {fallback_output}")
-            return fallback_output
+            return self._fallback_output(e)
+    
+    async def validate_batch(self, items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Validate several responses with concurrent LLM calls.
+        
+        Args:
+            items: Dicts with "bot_response" and "bot_position" keys
+            
+        Returns:
+            One validation result per item, in input order
+        """
+        if not items:
+            return []
+        
+        results: Dict[int, Dict[str, Any]] = {}
+        prompts = []
+        indices = []
+        for index, item in enumerate(items):
+            try:
+                prompts.append(self._format_prompt(item["bot_response"], item["bot_position"]))
+                indices.append(index)
+            except Exception as e:
+                results[index] = self._fallback_output(e)
+        
+        # max_concurrency must be explicit, otherwise abatch may serialize calls
+        responses = await self.structured_llm.abatch(
+            prompts,
+            config={"max_concurrency": settings.validation_max_concurrency},
+            return_exceptions=True
+        )
+        
+        for index, response in zip(indices, responses):
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                results[index] = self._parse_verdict(response)
+            except Exception as e:
+                results[index] = self._fallback_output(e)
+        
+        # abatch answers every prompt; an item left without a result is never approved
+        return [
+            results[index] if index in results
+            else self._fallback_output(RuntimeError("No validation result returned"))
+            for index in range(len(items))
+        ]
+
+
+@cache
+def get_consistency_validation_chain() -> ConsistencyValidationChain:
+    """Return the shared chain instance, creating its LLM client on first use."""
+    return ConsistencyValidationChain()
 
 
-# Global instance
-consistency_validation_chain = ConsistencyValidationChain()
+def __getattr__(name: str):
+    # Lazy global instance: building ChatOpenAI is deferred until first access
+    if name == "consistency_validation_chain":
+        return get_consistency_validation_chain()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
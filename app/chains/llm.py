@@ -0,0 +1,32 @@
+"""
+Shared HTTP transport for the chains' OpenAI models.
+All ChatOpenAI instances send their async requests through one connection pool
+so keep-alive connections and TLS sessions are reused between chains.
+"""
+
+from functools import cache
+import httpx
+from app.config import settings
+
+try:
+    import h2  # noqa: F401 - enables HTTP/2 multiplexing in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:  # pragma: no cover - optional dependency
+    HTTP2_AVAILABLE = False
+
+
+@cache
+def get_http_async_client() -> httpx.AsyncClient:
+    """Return the process-wide async HTTP client, creating it on first use."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        http2=HTTP2_AVAILABLE,
+        timeout=settings.openai_timeout_seconds
+    )
+
+
+async def close_http_async_client() -> None:
+    """Close the shared HTTP client if it was created, so shutdown releases its sockets."""
+    if get_http_async_client.cache_info().currsize:
+        await get_http_async_client().aclose()
+        get_http_async_client.cache_clear()
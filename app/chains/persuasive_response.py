@@ -3,10 +3,74 @@ Response Chain for generating bot responses that maintain assigned debate positi
 Generates responses while staying consistent with assigned position.
 """
 
-from typing import Dict, Any, List
-from langchain.prompts import PromptTemplate
+import logging
+import re
+from functools import cache
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple
+from pydantic import BaseModel, Field
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from app.config import settings
+from app.chains.llm import get_http_async_client
+from app.chains.prompt_cache import cached_prompt_tokens
+
+logger = logging.getLogger(__name__)
+
+HISTORY_WINDOW = 6  # Most recent messages included as context
+MAX_HISTORY_MESSAGE_CHARS = 500  # Per-message cap to bound prompt tokens
+REPETITION_WINDOW = 2  # Earlier user messages compared against the latest one
+REPETITION_THRESHOLD = 0.8  # Jaccard similarity above which a message counts as repeated
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+# Returned when the LLM call fails; the position is interpolated on the error path only
+_ERROR_RESPONSE_TEMPLATE = "[ERROR] I maintain that {position}."
+
+
+def _format_history(history: List[Dict[str, Any]]) -> Tuple[str, List[str]]:
+    """
+    Format the tail of the conversation in a single pass.
+    
+    Returns:
+        Tuple of (formatted history text, normalized user messages for repetition checks)
+    """
+    parts = []
+    user_messages = []
+    for msg in history[-HISTORY_WINDOW:]:
+        role = msg.get("role", "unknown")
+        content = msg.get("message", "")[:MAX_HISTORY_MESSAGE_CHARS]
+        parts.append(f"{role.upper()}: {content}")
+        
+        # Collect user messages to detect repetition
+        if role.lower() == "user":
+            user_messages.append(content.lower().strip())
+    return "\n".join(parts), user_messages
+
+
+def _is_repetitive(user_messages: List[str]) -> bool:
+    """
+    Check whether the latest user message repeats an earlier one.
+    
+    Compares token sets with Jaccard similarity so near-duplicates such as
+    "I disagree" and "I disagree!" are caught, not just exact matches.
+    """
+    if len(user_messages) < 2:
+        return False
+    
+    latest = frozenset(_WORD_PATTERN.findall(user_messages[-1]))
+    for previous in user_messages[-REPETITION_WINDOW - 1:-1]:
+        tokens = frozenset(_WORD_PATTERN.findall(previous))
+        if len(latest & tokens) / max(len(latest | tokens), 1) > REPETITION_THRESHOLD:
+            return True
+    return False
+
+
+class ResponseWithMeta(BaseModel):
+    """Generated reply together with the model's own consistency check."""
+    response: str = Field(description="The reply to send to the user")
+    consistency_score: int = Field(description="Self-assessed score from 1 to 10 for how firmly the reply maintains the assigned position")
+    approved: bool = Field(description="True if the reply maintains the assigned position and follows all rules")
 
 
 class PersuasiveResponseChain:
@@ -18,55 +82,48 @@ class PersuasiveResponseChain:
             temperature=0.8,
             openai_api_key=settings.openai_api_key,
             openai_api_base=settings.openai_base_url,
-            request_timeout=settings.openai_timeout_seconds
+            request_timeout=settings.openai_timeout_seconds,
+            http_async_client=get_http_async_client(),
+            cache=False  # High temperature output must never be replayed from cache
+        )
+        # Generation and self-check in one call; see generate_checked_response
+        self.checked_llm = self.llm.with_structured_output(
+            ResponseWithMeta, method="json_schema", include_raw=True
         )
         
-        self.prompt = PromptTemplate(
-            input_variables=["position", "user_message", "conversation_history", "topic", "user_language", "is_repetitive"],
-            template="""
+        # Static instructions live in the system message so the prompt prefix is
+        # byte-identical across requests and eligible for OpenAI prompt caching.
+        # Everything request-specific goes into the trailing user message, which
+        # is the only template rendered per call; the system message is a literal.
+        # Mustache triple braces insert values raw and never parse user text.
+        self.prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content="""
 You are a debate bot that maintains a specific position in a respectful discussion.
 
-YOUR POSITION: {position}
-TOPIC: {topic}
-
-CONVERSATION HISTORY:
-{conversation_history}
-
-USER'S LATEST MESSAGE: {user_message}
-USER IS BEING REPETITIVE: {is_repetitive}
-
 RULES:
-1. ALWAYS respond in the SAME LANGUAGE as the user's message (detect it automatically from their text)
-2. NEVER change your position - maintain your assigned stance
-3. Present your position clearly and respectfully
-4. Keep responses short and concise (30-80 words)
-5. Be conversational, not argumentative
-6. If user is repetitive, ask for new points politely
-
-RESPONSE STYLE:
-- Present your viewpoint calmly
-- Share relevant examples or reasoning
-- State your position confidently
-- Stay focused on the topic
-- DO NOT ask follow-up questions
-
-WHEN USER DISAGREES:
-- Acknowledge their point respectfully
-- Share why you see it differently
-- Reinforce your position with evidence
+1. ALWAYS respond in the SAME LANGUAGE as the user's message
+2. NEVER change your assigned position; state it clearly and confidently
+3. Keep responses short and concise (30-80 words), conversational, not argumentative
+4. Stay on topic and DO NOT ask follow-up questions
 
-WHEN USER GIVES VAGUE DISAGREEMENT (like "I don't think so", "Not really", "I disagree"):
-- Provide a concrete example supporting your position
-- State why your position is stronger
-- Present additional evidence for your stance
+WHEN USER DISAGREES (including vague replies like "I don't think so"):
+- Acknowledge their point respectfully
+- Reinforce your position with a concrete example or evidence
 
 WHEN USER IS REPETITIVE:
-- "I understand that point. My position remains that [restate position]."
-- "We've covered that. I still maintain [restate position]."
+- Briefly note the point was covered, restate your position, and invite new arguments
+"""),
+            ("user", """
+YOUR POSITION: {{{position}}}
+TOPIC: {{{topic}}}
 
-Generate a concise, respectful response that maintains your position WITHOUT asking questions.
-"""
-        )
+CONVERSATION HISTORY:
+{{{conversation_history}}}
+
+USER'S LATEST MESSAGE: {{{user_message}}}
+USER IS BEING REPETITIVE: {{{is_repetitive}}}
+""")
+        ], template_format="mustache")
     
     @property
     def input_keys(self) -> list[str]:
@@ -76,64 +133,66 @@ Generate a concise, respectful response that maintains your position WITHOUT ask
     def output_keys(self) -> list[str]:
         return ["response"]
     
-    def generate_response(self, user_message: str, topic: str, bot_position: str, conversation_history: List[Dict[str, Any]] = None) -> str:
-        """Generate persuasive response maintaining bot position."""
-        import logging
-        logger = logging.getLogger(__name__)
+    def _build_prompt(
+        self,
+        user_message: str,
+        topic: str,
+        bot_position: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None
+    ) -> List[BaseMessage]:
+        """Format the chat prompt for a turn, detecting repetitive user input."""
+        logger.info("[PERSUASIVE_RESPONSE] INPUT: user_message='%s', topic='%s', bot_position='%s'", user_message, topic, bot_position)
+        
+        # Format conversation history for context and detect repetitive patterns
+        history = conversation_history or []
+        if history:
+            logger.info("[PERSUASIVE_RESPONSE] CONVERSATION_HISTORY: %s messages", len(history))
+        formatted_history, user_messages = _format_history(history)
+        
+        # Check for repetitive user responses
+        is_repetitive = _is_repetitive(user_messages)
+        
+        logger.info("[PERSUASIVE_RESPONSE] IS_REPETITIVE: %s", is_repetitive)
         
+        # Let LLM detect language naturally from user message
+        user_language = "auto-detect"
+        logger.info("[PERSUASIVE_RESPONSE] LANGUAGE_MODE: %s", user_language)
+        
+        # Prepare inputs for prompt
+        prompt_inputs = {
+            "user_message": user_message,
+            "topic": topic,
+            "position": bot_position,
+            "conversation_history": formatted_history,
+            "user_language": user_language,
+            "is_repetitive": is_repetitive
+        }
+        
+        logger.info("[PERSUASIVE_RESPONSE] PROMPT_INPUTS: %s", prompt_inputs)
+        
+        # Format the prompt
+        formatted_prompt = self.prompt.format_messages(**prompt_inputs)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[PERSUASIVE_RESPONSE] FORMATTED_PROMPT: %s...", formatted_prompt[-1].content[:300])
+        return formatted_prompt
+    
+    async def generate_response(
+        self,
+        user_message: str,
+        topic: str,
+        bot_position: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """Generate persuasive response maintaining bot position."""
         try:
-            logger.info(f"[PERSUASIVE_RESPONSE] INPUT: user_message='{user_message}', topic='{topic}', bot_position='{bot_position}'")
-            
-            # Format conversation history for context and detect repetitive patterns
-            history = conversation_history or []
-            formatted_history = ""
-            user_messages = []
-            
-            if history:
-                logger.info(f"[PERSUASIVE_RESPONSE] CONVERSATION_HISTORY: {len(history)} messages")
-                for msg in history[-6:]:  # Last 6 messages for context
-                    role = msg.get("role", "unknown")
-                    content = msg.get("message", "")
-                    formatted_history += f"{role.upper()}: {content}\n"
-                    
-                    # Collect user messages to detect repetition
-                    if role.lower() == "user":
-                        user_messages.append(content.lower().strip())
-            
-            # Check for repetitive user responses
-            is_repetitive = False
-            if len(user_messages) >= 3:
-                # Check if last 3 user messages are very similar
-                recent_messages = user_messages[-3:]
-                if len(set(recent_messages)) <= 1:  # All messages are identical or very similar
-                    is_repetitive = True
-            
-            logger.info(f"[PERSUASIVE_RESPONSE] IS_REPETITIVE: {is_repetitive}")
-            
-            # Let LLM detect language naturally from user message
-            user_language = "auto-detect"
-            logger.info(f"[PERSUASIVE_RESPONSE] LANGUAGE_MODE: {user_language}")
-            
-            # Prepare inputs for prompt
-            prompt_inputs = {
-                "user_message": user_message,
-                "topic": topic,
-                "position": bot_position,
-                "conversation_history": formatted_history,
-                "user_language": user_language,
-                "is_repetitive": is_repetitive
-            }
-            
-            logger.info(f"[PERSUASIVE_RESPONSE] PROMPT_INPUTS: {prompt_inputs}")
-            
-            # Format the prompt
-            formatted_prompt = self.prompt.format(**prompt_inputs)
-            logger.debug(f"[PERSUASIVE_RESPONSE] FORMATTED_PROMPT: {formatted_prompt[:300]}...")
+            formatted_prompt = self._build_prompt(user_message, topic, bot_position, conversation_history)
             
             # Get response from LLM
-            response = self.llm.invoke(formatted_prompt)
-            raw_response = response.content if hasattr(response, 'content') else str(response)
-            logger.info(f"[PERSUASIVE_RESPONSE] LLM_RESPONSE: {raw_response}")
+            response = await self.llm.ainvoke(formatted_prompt)
+            raw_response = response.content
+            logger.info("[PERSUASIVE_RESPONSE] LLM_RESPONSE: %s", raw_response)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[PERSUASIVE_RESPONSE] CACHED_PROMPT_TOKENS: %s", cached_prompt_tokens(response))
             
             # Extract response content
             response_text = raw_response
@@ -141,14 +200,79 @@ Generate a concise, respectful response that maintains your position WITHOUT ask
             # Clean up response (remove quotes, extra whitespace)
             response_text = response_text.strip().strip('"\'')
             
-            logger.info(f"[PERSUASIVE_RESPONSE] FINAL_OUTPUT: {response_text}")
+            logger.info("[PERSUASIVE_RESPONSE] FINAL_OUTPUT: %s", response_text)
             return response_text
             
         except Exception as e:
             # Simple fallback - let LLM handle language naturally in future calls
-            logger.error(f"[PERSUASIVE_RESPONSE] ERROR: {str(e)}")
-            return f"[ERROR] I maintain that {bot_position.lower()}."
+            logger.error("[PERSUASIVE_RESPONSE] ERROR: %s", e)
+            return _ERROR_RESPONSE_TEMPLATE.format(position=bot_position.lower())
+    
+    async def generate_checked_response(
+        self,
+        user_message: str,
+        topic: str,
+        bot_position: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate a response and its self-consistency verdict in a single LLM call.
+        
+        Returns:
+            Dict with "response", "consistency_score" and "approved" keys
+        """
+        try:
+            formatted_prompt = self._build_prompt(user_message, topic, bot_position, conversation_history)
+            
+            # Get structured response from LLM
+            result = await self.checked_llm.ainvoke(formatted_prompt)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[PERSUASIVE_RESPONSE] CACHED_PROMPT_TOKENS: %s", cached_prompt_tokens(result["raw"]))
+            if result["parsing_error"] is not None:
+                raise result["parsing_error"]
+            
+            output = result["parsed"].model_dump()
+            output["response"] = output["response"].strip().strip('"\'')
+            
+            logger.info("[PERSUASIVE_RESPONSE] CHECKED_OUTPUT: %s", output)
+            return output
+            
+        except Exception as e:
+            logger.error("[PERSUASIVE_RESPONSE] ERROR: %s", e)
+            return {
+                "response": _ERROR_RESPONSE_TEMPLATE.format(position=bot_position.lower()),
+                "consistency_score": 0,
+                "approved": False
+            }
+    
+    async def astream_response(
+        self,
+        user_message: str,
+        topic: str,
+        bot_position: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream a persuasive response token by token.
+        
+        Yields content chunks as they arrive from the LLM so callers can forward
+        them immediately instead of waiting for the full completion.
+        """
+        formatted_prompt = self._build_prompt(user_message, topic, bot_position, conversation_history)
+        
+        async for chunk in self.llm.astream(formatted_prompt):
+            if chunk.content:
+                yield chunk.content
+
+
+@cache
+def get_persuasive_response_chain() -> PersuasiveResponseChain:
+    """Return the shared chain instance, creating its LLM client on first use."""
+    return PersuasiveResponseChain()
 
 
-# Global instance
-persuasive_response_chain = PersuasiveResponseChain()
+def __getattr__(name: str):
+    # Lazy global instance: building ChatOpenAI is deferred until first access
+    if name == "persuasive_response_chain":
+        return get_persuasive_response_chain()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
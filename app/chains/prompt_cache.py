@@ -0,0 +1,13 @@
+"""
+Helpers for OpenAI automatic prompt caching.
+Chains keep their static instructions in a leading system message; these helpers
+report how much of that prefix was served from OpenAI's cache.
+"""
+
+from typing import Any
+
+
+def cached_prompt_tokens(response: Any) -> int:
+    """Return the number of prompt tokens OpenAI served from its prompt cache."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("input_token_details", {}).get("cache_read", 0)
@@ -3,10 +3,24 @@ Topic Analysis Chain for identifying conversation topics from user messages.
 Analyzes the first user message to determine the debate topic.
 """
 
+import hashlib
+import logging
+import re
+from functools import cache
 from typing import Dict, Any
-from langchain.prompts import PromptTemplate
+import orjson
+from cachetools import LRUCache
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from app.config import settings
+from app.chains.llm import get_http_async_client
+from app.chains.prompt_cache import cached_prompt_tokens
+
+logger = logging.getLogger(__name__)
+
+# JSON object wrapped in a markdown code fence
+_JSON_FENCE = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```', re.DOTALL)
 
 
 class TopicAnalysisChain:
@@ -18,15 +32,19 @@ class TopicAnalysisChain:
             temperature=0.3,
             openai_api_key=settings.openai_api_key,
             openai_api_base=settings.openai_base_url,
-            request_timeout=settings.openai_timeout_seconds
+            request_timeout=settings.openai_timeout_seconds,
+            http_async_client=get_http_async_client()
         )
         
-        self.prompt = PromptTemplate(
-            input_variables=["user_message"],
-            template="""
-Analyze this user message to understand what they're discussing and determine how to engage in debate.
-
-User message: "{user_message}"
+        # Exact-match cache of parsed analyses, keyed by normalized message digest
+        self._cache: LRUCache = LRUCache(maxsize=settings.topic_cache_size)
+        
+        # Static instructions and examples form a byte-stable system prefix that
+        # OpenAI caches automatically; only the user message follows it and is
+        # rendered per call
+        self.prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content="""
+Analyze the user's message to understand what they're discussing and determine how to engage in debate.
 
 Tasks:
 1. Identify the main topic being discussed
@@ -42,23 +60,24 @@ Return ONLY a JSON object with these fields:
 - "controversy_level": Number 1-10
 
 Examples:
-{{
+{
     "topic": "Remote work productivity",
     "user_position": "Working from home is more productive",
     "bot_position": "Office work is more productive due to better collaboration and fewer distractions",
     "controversy_level": 6
-}}
+}
 
-{{
+{
     "topic": "Cola preference",
     "user_position": "neutral question",
     "bot_position": "Pepsi is superior to Coca-Cola due to its sweeter taste and better marketing",
     "controversy_level": 3
-}}
+}
 
 Return only the JSON, no markdown formatting or extra text.
-"""
-        )
+"""),
+            ("user", 'User message: "{{{user_message}}}"')
+        ], template_format="mustache")
     
     @property
     def input_keys(self) -> list[str]:
@@ -68,32 +87,39 @@ Return only the JSON, no markdown formatting or extra text.
     def output_keys(self) -> list[str]:
         return ["topic", "user_position", "bot_position", "controversy_level"]
     
-    def analyze_topic(self, user_message: str) -> Dict[str, Any]:
+    @staticmethod
+    def _cache_key(user_message: str) -> bytes:
+        """Digest of the normalized message so cache keys stay small."""
+        normalized = " ".join(user_message.lower().split())
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+    
+    async def analyze_topic(self, user_message: str) -> Dict[str, Any]:
         """Analyze user message to identify debate topic."""
-        import logging
-        logger = logging.getLogger(__name__)
-        
         try:
-            logger.info(f"[TOPIC_ANALYSIS] INPUT: user_message='{user_message}'")
+            logger.info("[TOPIC_ANALYSIS] INPUT: user_message='%s'", user_message)
+            
+            cache_key = self._cache_key(user_message)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                logger.info("[TOPIC_ANALYSIS] CACHE_HIT: %s", cached)
+                return dict(cached)
             
             # Format the prompt
-            formatted_prompt = self.prompt.format(user_message=user_message)
-            logger.debug(f"[TOPIC_ANALYSIS] PROMPT: {formatted_prompt[:200]}...")
+            formatted_prompt = self.prompt.format_messages(user_message=user_message)
+            logger.debug("[TOPIC_ANALYSIS] PROMPT: %.200s...", formatted_prompt[-1].content)
             
             # Get response from LLM
-            response = self.llm.invoke(formatted_prompt)
-            raw_response = response.content if hasattr(response, 'content') else str(response)
-            logger.info(f"[TOPIC_ANALYSIS] LLM_RESPONSE: {raw_response}")
+            response = await self.llm.ainvoke(formatted_prompt)
+            raw_response = response.content
+            logger.info("[TOPIC_ANALYSIS] LLM_RESPONSE: %s", raw_response)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[TOPIC_ANALYSIS] CACHED_PROMPT_TOKENS: %s", cached_prompt_tokens(response))
             
-            # Parse JSON response - handle markdown code blocks
-            import json
-            import re
-            
-            # Remove markdown code blocks if present
+            # Parse JSON response - remove markdown code blocks if present
             json_text = raw_response.strip()
             if json_text.startswith('```'):
                 # Extract JSON from markdown code block
-                json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', json_text, re.DOTALL)
+                json_match = _JSON_FENCE.search(json_text)
                 if json_match:
                     json_text = json_match.group(1)
                 else:
@@ -105,7 +131,7 @@ Return only the JSON, no markdown formatting or extra text.
                         lines = lines[:-1]
                     json_text = '\n'.join(lines)
             
-            result = json.loads(json_text)
+            result = orjson.loads(json_text)
             
             output = {
                 "topic": result.get("topic", "General Discussion"),
@@ -114,11 +140,13 @@ Return only the JSON, no markdown formatting or extra text.
                 "controversy_level": result.get("controversy_level", 5)
             }
             
-            logger.info(f"[TOPIC_ANALYSIS] OUTPUT: {output}")
-            return output
+            logger.info("[TOPIC_ANALYSIS] OUTPUT: %s", output)
+            # Only successful analyses are cached; fallbacks are retried next time
+            self._cache[cache_key] = output
+            return dict(output)
             
         except Exception as e:
-            logger.error(f"[TOPIC_ANALYSIS] ERROR: {str(e)}")
+            logger.error("[TOPIC_ANALYSIS] ERROR: %s", e)
             # Fallback if analysis fails
             fallback_output = {
                 "topic": "General Discussion",
@@ -126,9 +154,18 @@ Return only the JSON, no markdown formatting or extra text.
                 "bot_position": "I will take a contrarian stance to encourage healthy debate",
                 "controversy_level": 5
             }
-            logger.info(f"[TOPIC_ANALYSIS] FALLBACK_OUTPUT: {fallback_output}")
+            logger.info("[TOPIC_ANALYSIS] FALLBACK_OUTPUT: %s", fallback_output)
             return fallback_output
 
 
-# Global instance
-topic_analysis_chain = TopicAnalysisChain()
+@cache
+def get_topic_analysis_chain() -> TopicAnalysisChain:
+    """Return the shared chain instance, creating its LLM client on first use."""
+    return TopicAnalysisChain()
+
+
+def __getattr__(name: str):
+    # Lazy global instance: building ChatOpenAI is deferred until first access
+    if name == "topic_analysis_chain":
+        return get_topic_analysis_chain()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
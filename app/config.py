@@ -4,8 +4,9 @@ Handles environment variables and application settings.
 """
 
 import os
-from typing import Optional
-from pydantic_settings import BaseSettings
+from functools import lru_cache
+from typing import List, Literal, Optional
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
 
 
@@ -17,6 +18,7 @@ class Settings(BaseSettings):
     
     # Database
     database_url: str = "sqlite:///./conversations.db"
+    conversation_cache_size: int = 4096  # Static conversation fields kept in memory
     
     # Service URLs
     openai_base_url: str = "https://api.openai.com/v1"
@@ -25,15 +27,37 @@ class Settings(BaseSettings):
     base_url: str = "http://localhost:8000"
     api_base_url: str = "http://localhost:8000"
     
+    # CORS (JSON list in the environment, e.g. CORS_ORIGINS='["https://app.example.com"]')
+    cors_origins: List[str] = ["http://localhost:3000", "http://localhost:8000"]
+    
     # Performance & Limits
     max_response_time: int = 30
     max_message_length: int = 5000
     rate_limit_per_minute: int = 100
+    rate_limit_strategy: Literal["token_bucket", "sliding_window"] = "token_bucket"  # In-process limiter
+    redis_url: Optional[str] = None  # Shared rate limiting across workers when set
+    workers: int = 1  # uvicorn worker processes; set REDIS_URL as well when above 1
     
     # Retry Configuration
     max_retries: int = 3
     retry_delay_seconds: int = 1
     openai_timeout_seconds: int = 25
+    max_openai_concurrency: int = 50  # In-flight direct OpenAI calls per worker
+    
+    # Background chat tasks (/chat?mode=async)
+    task_store_size: int = 10000
+    task_result_ttl_seconds: int = 3600  # How long finished results can be polled
+    
+    # Topic Analysis
+    topic_cache_size: int = 10000
+    
+    # Response Generation
+    candidates_per_attempt: int = 1  # Parallel replies per validation attempt; each extra one is another LLM call
+    
+    # Consistency Validation
+    validation_cache_size: int = 1000
+    validation_max_concurrency: int = 10
+    consistency_audit_rate: float = 0.05  # Share of turns re-checked by the separate validator
     
     # Logging
     log_level: str = "INFO"
@@ -41,15 +65,16 @@ class Settings(BaseSettings):
     # Environment
     environment: str = "development"
     
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
+    # Frozen: settings are read-only after startup
+    model_config = SettingsConfigDict(env_file=".env", case_sensitive=False, frozen=True)
 
 
+@lru_cache(maxsize=1)
 def load_settings() -> Settings:
     """
     Load settings based on environment.
     Automatically loads .env.dev for development or .env.prod for production.
+    Cached so the env files are read and validated once per process.
     """
     env = os.getenv("ENVIRONMENT", "development")
     
@@ -4,13 +4,30 @@ Implements the chat API with automatic Swagger documentation.
 """
 
 import logging
-from datetime import datetime
-from fastapi import FastAPI, HTTPException, status
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Literal
+import orjson
+from fastapi import FastAPI, HTTPException, Query, status
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.utils import is_body_allowed_for_status_code
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from app.config import settings
-from app.models.schemas import ChatRequest, ChatResponse, ErrorResponse, HealthResponse
-from app.services import conversation_service
-from app.middleware import RateLimitMiddleware, ErrorHandlerMiddleware, ConversationNotFoundError, AIServiceError
+from app.chains.llm import close_http_async_client
+from app.models.schemas import ChatRequest, ChatResponse, ErrorResponse, HealthResponse, TaskResponse
+from app.services import conversation_service, task_service
+from app.middleware import (
+    RateLimitMiddleware,
+    ErrorHandlerMiddleware,
+    ConversationNotFoundError,
+    AIServiceError,
+    extra_fields_response,
+    is_extra_fields_error
+)
 from app import __version__
 
 # Configure logging
@@ -20,13 +37,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Initialize the application on startup and release shared clients on shutdown."""
+    logger.info("Starting Debate Bot API v%s", __version__)
+    logger.info("Environment: %s", settings.environment)
+    logger.info("Log level: %s", settings.log_level)
+    logger.info("Rate limit: %s requests/minute", settings.rate_limit_per_minute)
+    
+    # Validate OpenAI API key on startup
+    from app.services.retry_service import openai_client
+    if not await openai_client.validate_api_key():
+        logger.error("OpenAI API key validation failed!")
+    else:
+        logger.info("OpenAI API key validated successfully")
+    
+    yield
+    
+    logger.info("Shutting down Debate Bot API")
+    # Close the pooled OpenAI connections shared by the chains
+    await close_http_async_client()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Debate Bot API",
     description="A conversational AI that maintains controversial positions in debates",
     version=__version__,
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Add middleware
@@ -34,17 +75,41 @@ app.add_middleware(ErrorHandlerMiddleware)
 app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately for production
+    allow_origins=settings.cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 
+@app.exception_handler(StarletteHTTPException)
+async def http_exception_handler(request, exc: StarletteHTTPException) -> Response:
+    """Render HTTP errors with orjson; same body as FastAPI's default handler."""
+    if not is_body_allowed_for_status_code(exc.status_code):
+        return Response(status_code=exc.status_code, headers=exc.headers)
+    return Response(
+        content=orjson.dumps({"detail": exc.detail}),
+        status_code=exc.status_code,
+        headers=exc.headers,
+        media_type="application/json"
+    )
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request, exc: RequestValidationError) -> Response:
+    """Reject extra attributes with the static 400 body; other validation errors stay 422."""
+    # FastAPI answers validation errors itself, before ErrorHandlerMiddleware sees them
+    if is_extra_fields_error(exc):
+        logger.warning("Validation error: %s", exc)
+        return extra_fields_response()
+    return await request_validation_exception_handler(request, exc)
+
+
 @app.post(
     "/chat",
     response_model=ChatResponse,
     responses={
+        202: {"model": TaskResponse, "description": "Task accepted (mode=async)"},
         400: {"model": ErrorResponse, "description": "Invalid request format"},
         429: {"model": ErrorResponse, "description": "Rate limit exceeded"},
         500: {"model": ErrorResponse, "description": "Internal server error"}
@@ -58,9 +123,14 @@ app.add_middleware(
     - Only 'conversation_id' and 'message' attributes are allowed
     - Messages are limited to 5000 characters
     - Rate limited to 100 requests per minute per IP
+    - With `mode=async` the reply is generated in the background: the response
+      is a task to poll at /chat/tasks/{task_id}
     """
 )
-async def chat(request: ChatRequest):
+async def chat(
+    request: ChatRequest,
+    mode: Literal["sync", "async"] = Query("sync", description="Wait for the reply (sync) or return a task to poll (async)")
+):
     """
     Main chat endpoint for debating with the bot.
     
@@ -71,44 +141,139 @@ async def chat(request: ChatRequest):
     4. Continue the debate while staying consistent with its position
     """
     try:
+        if mode == "async":
+            # Generation can take several seconds; hand back a task right away
+            record = task_service.submit(request.conversation_id, request.message)
+            return Response(
+                content=orjson.dumps(record),
+                status_code=status.HTTP_202_ACCEPTED,
+                media_type="application/json"
+            )
+        
         if request.conversation_id is None or request.conversation_id == "":
             # Start new conversation
             logger.info("Starting new conversation")
-            result = conversation_service.start_new_conversation(request.message)
+            result = await conversation_service.start_new_conversation(request.message)
         else:
             # Continue existing conversation
-            logger.info(f"Continuing conversation: {request.conversation_id}")
-            result = conversation_service.continue_conversation(
+            logger.info("Continuing conversation: %s", request.conversation_id)
+            result = await conversation_service.continue_conversation(
                 request.conversation_id, 
                 request.message
             )
         
-        return ChatResponse(**result)
+        # The service builds the response from stored rows that were validated on the
+        # way in; encode it directly instead of validating every message again
+        return Response(content=orjson.dumps(result), media_type="application/json")
         
     except ValueError as e:
-        logger.warning(f"Invalid input: {e}")
+        logger.warning("Invalid input: %s", e)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
     except ConversationNotFoundError:
-        logger.warning(f"Conversation not found: {request.conversation_id}")
+        logger.warning("Conversation not found: %s", request.conversation_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Conversation {request.conversation_id} not found"
         )
     except AIServiceError as e:
-        logger.error(f"AI service error: {e}")
+        logger.error("AI service error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="AI service temporarily unavailable"
         )
     except Exception as e:
-        logger.error(f"Unexpected error in chat endpoint: {e}")
+        logger.error("Unexpected error in chat endpoint: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+
+@app.get(
+    "/chat/tasks/{task_id}",
+    response_model=TaskResponse,
+    responses={
+        404: {"model": ErrorResponse, "description": "Task not found or expired"}
+    },
+    summary="Poll a background chat task",
+    description="Return the status of a task created with /chat?mode=async, including the chat response once completed."
+)
+async def chat_task(task_id: str):
+    """Status endpoint for background chat tasks."""
+    record = task_service.get(task_id)
+    if record is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Task {task_id} not found"
+        )
+    return Response(content=orjson.dumps(record), media_type="application/json")
+
+
+def _sse_event(event: str, data: dict) -> bytes:
+    """Format a single Server-Sent Event frame."""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+@app.post(
+    "/chat/stream",
+    responses={
+        200: {"content": {"text/event-stream": {}}, "description": "Server-Sent Events stream of the bot reply"},
+        400: {"model": ErrorResponse, "description": "Invalid request format"},
+        404: {"model": ErrorResponse, "description": "Conversation not found"},
+        429: {"model": ErrorResponse, "description": "Rate limit exceeded"},
+        500: {"model": ErrorResponse, "description": "Internal server error"}
+    },
+    summary="Chat with the debate bot (streaming)",
+    description="""
+    Same request body as /chat, but the bot reply is streamed as Server-Sent Events.
+    
+    - `start`: sent first, carries the conversation_id
+    - `token`: one per response chunk, carries the text delta
+    - `done`: sent last, carries the complete bot message
+    
+    Streamed replies skip the validation and retries used by /chat.
+    """
+)
+async def chat_stream(request: ChatRequest):
+    """Streaming variant of the chat endpoint for low time-to-first-token clients."""
+    try:
+        conversation_id, chunks = await conversation_service.stream_conversation(
+            request.conversation_id,
+            request.message
+        )
+    except ConversationNotFoundError:
+        logger.warning("Conversation not found: %s", request.conversation_id)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Conversation {request.conversation_id} not found"
+        )
+    except Exception as e:
+        logger.error("Unexpected error in chat stream endpoint: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred"
         )
+    
+    async def event_stream() -> AsyncIterator[bytes]:
+        parts = []
+        yield _sse_event("start", {"conversation_id": conversation_id})
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield _sse_event("token", {"token": chunk})
+        yield _sse_event("done", {"conversation_id": conversation_id, "message": "".join(parts).strip()})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Health probes fire many times per second; refresh the timestamp at most once a second
+_HEALTH_CACHE = {"t": 0.0, "s": ""}
 
 
 @app.get(
@@ -123,15 +288,22 @@ async def health():
     
     Returns the current status of the API service.
     """
+    now = time.monotonic()
+    if not _HEALTH_CACHE["s"] or now - _HEALTH_CACHE["t"] >= 1.0:
+        _HEALTH_CACHE.update(
+            t=now,
+            s=datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        )
+    
     return HealthResponse(
         status="healthy",
-        timestamp=datetime.utcnow().isoformat() + "Z",
+        timestamp=_HEALTH_CACHE["s"],
         version=__version__
     )
 
 
 @app.get("/", include_in_schema=False)
-async def root():
+async def root() -> Dict[str, str]:
     """Root endpoint redirect to docs."""
     return {
         "message": "Debate Bot API",
@@ -141,36 +313,16 @@ async def root():
     }
 
 
-# Startup event
-@app.on_event("startup")
-async def startup_event():
-    """Initialize application on startup."""
-    logger.info(f"Starting Debate Bot API v{__version__}")
-    logger.info(f"Environment: {settings.environment}")
-    logger.info(f"Log level: {settings.log_level}")
-    logger.info(f"Rate limit: {settings.rate_limit_per_minute} requests/minute")
-    
-    # Validate OpenAI API key on startup
-    from app.services.retry_service import openai_client
-    if not openai_client.validate_api_key():
-        logger.error("OpenAI API key validation failed!")
-    else:
-        logger.info("OpenAI API key validated successfully")
-
-
-# Shutdown event
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on application shutdown."""
-    logger.info("Shutting down Debate Bot API")
-
-
 if __name__ == "__main__":
     import uvicorn
+    development = settings.environment == "development"
     uvicorn.run(
-        app,
+        "app.main:app",  # Import string, required for reload and multiple workers
         host="0.0.0.0",
         port=8000,
-        reload=settings.environment == "development",
+        reload=development,
+        workers=None if development else settings.workers,
+        loop="auto",  # uvloop/httptools when installed, asyncio/h11 otherwise (e.g. Windows)
+        http="auto",
         log_level=settings.log_level.lower()
     )
@@ -4,7 +4,14 @@ Contains rate limiting and error handling middleware.
 """
 
 from .rate_limiter import RateLimitMiddleware, rate_limiter
-from .error_handler import ErrorHandlerMiddleware, ConversationNotFoundError, AIServiceError, DatabaseError
+from .error_handler import (
+    ErrorHandlerMiddleware,
+    ConversationNotFoundError,
+    AIServiceError,
+    DatabaseError,
+    extra_fields_response,
+    is_extra_fields_error
+)
 
 __all__ = [
     "RateLimitMiddleware",
@@ -12,5 +19,7 @@ __all__ = [
     "rate_limiter",
     "ConversationNotFoundError",
     "AIServiceError", 
-    "DatabaseError"
+    "DatabaseError",
+    "extra_fields_response",
+    "is_extra_fields_error"
 ]
\ No newline at end of file
@@ -3,124 +3,153 @@ Global error handling middleware for the debate bot API.
 Handles exceptions and provides consistent error responses.
 """
 
-import traceback
-from typing import Union
-from fastapi import Request, HTTPException, status
-from fastapi.responses import JSONResponse
+from typing import Any, Union
+import orjson
+from fastapi import HTTPException, status
+from fastapi.responses import Response
 from fastapi.exceptions import RequestValidationError
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from pydantic import ValidationError
 from app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Settings are frozen, so read the values used on every error response once
+_POSTMAN_URL = settings.postman_collection_url
+_SWAGGER_URL = settings.swagger_docs_url
+_IS_PRODUCTION = settings.environment == "production"
 
-class ErrorHandlerMiddleware(BaseHTTPMiddleware):
-    """Middleware for global error handling and consistent error responses."""
+
+def _error_body(error: str, message: Any) -> bytes:
+    """Encode the standard error payload, including the documentation links."""
+    return orjson.dumps({
+        "error": error,
+        "message": message,
+        "postman_collection": _POSTMAN_URL,
+        "swagger_docs": _SWAGGER_URL
+    })
+
+
+def _json_response(status_code: int, body: bytes) -> Response:
+    """Wrap an already encoded JSON body in a response."""
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+# Static error bodies, encoded once at import
+_EXTRA_FIELDS_BODY = _error_body(
+    "Invalid request format",
+    "Only 'conversation_id' and 'message' attributes are allowed"
+)
+_INTERNAL_ERROR_BODY = _error_body("Internal server error", "An internal error occurred")
+
+
+def is_extra_fields_error(error: Union[RequestValidationError, ValidationError]) -> bool:
+    """Whether a validation error was caused by attributes outside the request schema."""
+    errors = error.errors() if hasattr(error, 'errors') else []
+    return any(err.get('type') == 'extra_forbidden' for err in errors)
+
+
+def extra_fields_response() -> Response:
+    """Static 400 response for requests with attributes beyond conversation_id and message."""
+    return _json_response(status.HTTP_400_BAD_REQUEST, _EXTRA_FIELDS_BODY)
+
+
+def validation_error_response(error: Union[RequestValidationError, ValidationError]) -> Response:
+    """Handle Pydantic validation errors with detailed messages."""
+    errors = error.errors() if hasattr(error, 'errors') else []
+    
+    # Extra attributes are the common case (our strict validation requirement):
+    # answer with the static body before formatting any details
+    if any(err.get('type') == 'extra_forbidden' for err in errors):
+        return extra_fields_response()
+    
+    error_details = [
+        f"{err.get('loc', ['unknown'])[-1]}: {err.get('msg', 'Invalid value')}"
+        for err in errors
+    ]
+    
+    # General validation error
+    return _json_response(
+        status.HTTP_400_BAD_REQUEST,
+        _error_body(
+            "Validation error",
+            "; ".join(error_details) if error_details else "Invalid input format"
+        )
+    )
+
+
+class ErrorHandlerMiddleware:
+    """
+    Pure ASGI middleware for global error handling and consistent error responses.
+    Wraps the app directly instead of going through BaseHTTPMiddleware, so no
+    intermediate request/response objects are built on the success path.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Process request with comprehensive error handling."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        response_started = False
+        
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
         try:
-            response = await call_next(request)
-            return response
-            
-        except HTTPException as e:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            # Headers already sent (e.g. mid-stream failure): nothing sane to replace them with
+            if response_started:
+                raise
+            response = self._handle_exception(e)
+            await response(scope, receive, send)
+    
+    def _handle_exception(self, e: Exception) -> Response:
+        """Map an exception raised by the app to a JSON error response."""
+        if isinstance(e, HTTPException):
             # FastAPI HTTP exceptions (already handled)
-            return JSONResponse(
-                status_code=e.status_code,
-                content={
-                    "error": "HTTP Exception",
-                    "message": e.detail,
-                    "postman_collection": settings.postman_collection_url,
-                    "swagger_docs": settings.swagger_docs_url
-                }
+            return _json_response(
+                e.status_code,
+                _error_body("HTTP Exception", e.detail)
             )
-            
-        except RequestValidationError as e:
+        
+        if isinstance(e, RequestValidationError):
             # Pydantic validation errors
-            logger.warning(f"Validation error: {e}")
-            return self._handle_validation_error(e)
-            
-        except ValidationError as e:
+            logger.warning("Validation error: %s", e)
+            return validation_error_response(e)
+        
+        if isinstance(e, ValidationError):
             # Additional Pydantic validation errors
-            logger.warning(f"Pydantic validation error: {e}")
-            return self._handle_validation_error(e)
-            
-        except ValueError as e:
+            logger.warning("Pydantic validation error: %s", e)
+            return validation_error_response(e)
+        
+        if isinstance(e, ValueError):
             # Value errors (e.g., invalid conversation_id)
-            logger.warning(f"Value error: {e}")
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content={
-                    "error": "Invalid input",
-                    "message": str(e),
-                    "postman_collection": settings.postman_collection_url,
-                    "swagger_docs": settings.swagger_docs_url
-                }
-            )
-            
-        except Exception as e:
-            # Unexpected errors
-            logger.error(f"Unexpected error: {e}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            
-            # Don't expose internal errors in production
-            if settings.environment == "production":
-                error_message = "An internal error occurred"
-            else:
-                error_message = str(e)
-            
-            return JSONResponse(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content={
-                    "error": "Internal server error",
-                    "message": error_message,
-                    "postman_collection": settings.postman_collection_url,
-                    "swagger_docs": settings.swagger_docs_url
-                }
+            logger.warning("Value error: %s", e)
+            return _json_response(
+                status.HTTP_400_BAD_REQUEST,
+                _error_body("Invalid input", str(e))
             )
-    
-    def _handle_validation_error(self, error: Union[RequestValidationError, ValidationError]) -> JSONResponse:
-        """Handle Pydantic validation errors with detailed messages."""
-        
-        # Check if this is the "extra attributes" error we want to catch
-        error_details = []
-        has_extra_fields = False
         
-        if hasattr(error, 'errors'):
-            for err in error.errors():
-                error_type = err.get('type', '')
-                field = err.get('loc', ['unknown'])[-1]
-                
-                if error_type == 'extra_forbidden':
-                    has_extra_fields = True
-                    error_details.append(f"Extra field '{field}' not allowed")
-                else:
-                    error_details.append(f"{field}: {err.get('msg', 'Invalid value')}")
+        # Unexpected errors
+        # The traceback is only formatted if a handler actually emits the record
+        logger.exception("Unexpected error: %s", e)
         
-        # Special handling for extra fields (our strict validation requirement)
-        if has_extra_fields:
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content={
-                    "error": "Invalid request format",
-                    "message": "Only 'conversation_id' and 'message' attributes are allowed",
-                    "postman_collection": settings.postman_collection_url,
-                    "swagger_docs": settings.swagger_docs_url
-                }
-            )
+        # Don't expose internal errors in production
+        if _IS_PRODUCTION:
+            body = _INTERNAL_ERROR_BODY
+        else:
+            body = _error_body("Internal server error", str(e))
         
-        # General validation error
-        return JSONResponse(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            content={
-                "error": "Validation error",
-                "message": "; ".join(error_details) if error_details else "Invalid input format",
-                "postman_collection": settings.postman_collection_url,
-                "swagger_docs": settings.swagger_docs_url
-            }
-        )
+        return _json_response(status.HTTP_500_INTERNAL_SERVER_ERROR, body)
 
 
 # Custom exception classes
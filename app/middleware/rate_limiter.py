@@ -1,28 +1,60 @@
 """
 Rate limiting middleware for the debate bot API.
-Implements sliding window rate limiting with 100 requests per minute per IP.
+Implements token bucket (or sliding window counter) rate limiting with 100
+requests per minute per IP.
 """
 
+import inspect
 import time
-from typing import Dict, Optional
-from fastapi import Request, HTTPException, status
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from collections import defaultdict, deque
+from array import array
+from collections import deque
+import orjson
+from typing import Dict, Optional, Union
+from fastapi import status
+from starlette.types import ASGIApp, Receive, Scope, Send
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
 from app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Requests checked by the limiter, allowed or not, between sweeps of idle client state
+CLEANUP_INTERVAL_REQUESTS = 1000
+
+NS_PER_SECOND = 1_000_000_000
+
+# 429 body encoded once at import; only retry_after changes per response
+_RETRY_AFTER_PLACEHOLDER = b'"__RETRY_AFTER__"'
+_RATE_LIMIT_BODY_TEMPLATE = orjson.dumps({
+    "error": "Rate limit exceeded",
+    "message": f"Too many requests. Limit: {settings.rate_limit_per_minute} per minute",
+    "retry_after": "__RETRY_AFTER__",
+    "postman_collection": settings.postman_collection_url,
+    "swagger_docs": settings.swagger_docs_url
+})
+
 
 class RateLimiter:
-    """Sliding window rate limiter implementation."""
+    """
+    Token bucket rate limiter implementation.
+    Each IP holds up to max_requests tokens, refilled continuously at
+    max_requests per window_seconds; a request spends one token.
+    """
     
     def __init__(self, max_requests: int = 100, window_seconds: int = 60):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        # Store timestamps of requests per IP
-        self.requests: Dict[str, deque] = defaultdict(deque)
+        self.refill_rate = max_requests / window_seconds
+        self._refill_per_ns = self.refill_rate / NS_PER_SECOND
+        # IP -> slot index into the bucket arrays
+        self.buckets: Dict[str, int] = {}
+        # Bucket state lives in flat C arrays (8 bytes per value) instead of
+        # per-IP lists of boxed floats; freed slots are reused. Refill times are
+        # integer monotonic nanoseconds
+        self._tokens = array("d")
+        self._last_refill = array("q")
+        self._free_slots: deque = deque()
     
     def is_allowed(self, client_ip: str) -> tuple[bool, Optional[int]]:
         """
@@ -34,107 +66,270 @@ class RateLimiter:
         Returns:
             Tuple of (is_allowed, retry_after_seconds)
         """
-        current_time = time.time()
-        client_requests = self.requests[client_ip]
+        # Monotonic clock: wall-clock jumps must not refill or drain buckets
+        now = time.monotonic_ns()
+        slot = self.buckets.get(client_ip)
+        
+        if slot is None:
+            self.buckets[client_ip] = self._allocate_slot(self.max_requests - 1, now)
+            return True, None
+        
+        # Refill for the time elapsed since the last request, capped at capacity
+        tokens = min(self.max_requests, self._tokens[slot] + (now - self._last_refill[slot]) * self._refill_per_ns)
+        self._last_refill[slot] = now
+        
+        if tokens >= 1:
+            self._tokens[slot] = tokens - 1
+            return True, None
+        
+        self._tokens[slot] = tokens
+        # Retry once a whole token has been refilled
+        retry_after = int((1 - tokens) / self.refill_rate) + 1
+        return False, retry_after
+    
+    def _allocate_slot(self, tokens: float, now: int) -> int:
+        """Store a new bucket, reusing a freed slot when one is available."""
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._tokens[slot] = tokens
+            self._last_refill[slot] = now
+            return slot
+        
+        self._tokens.append(tokens)
+        self._last_refill.append(now)
+        return len(self._tokens) - 1
+    
+    def cleanup_old_entries(self):
+        """Drop buckets that have refilled completely; they are identical to a new IP."""
+        now = time.monotonic_ns()
+        tokens, last_refill = self._tokens, self._last_refill
+        
+        ips_to_remove = [
+            ip for ip, slot in self.buckets.items()
+            if tokens[slot] + (now - last_refill[slot]) * self._refill_per_ns >= self.max_requests
+        ]
+        
+        for ip in ips_to_remove:
+            self._free_slots.append(self.buckets.pop(ip))
+
+
+class SlidingWindowRateLimiter:
+    """
+    Sliding window counter rate limiter implementation.
+    The window is split into a fixed number of sub-windows, each holding a
+    request count, so memory per IP is constant while bursts at window
+    edges are limited to one sub-window's granularity.
+    """
+    
+    def __init__(self, max_requests: int = 100, window_seconds: int = 60, sub_windows: int = 6):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.sub_windows = sub_windows
+        # Integer nanoseconds keep the sub-window index computation in int arithmetic
+        self.sub_window_ns = window_seconds * NS_PER_SECOND // sub_windows
+        # IP -> [index of the newest sub-window seen, ring of per-sub-window counts]
+        self.windows: Dict[str, list] = {}
+    
+    def is_allowed(self, client_ip: str) -> tuple[bool, Optional[int]]:
+        """
+        Check if request is allowed for given IP.
         
-        # Remove old requests outside the window
-        while client_requests and client_requests[0] <= current_time - self.window_seconds:
-            client_requests.popleft()
+        Args:
+            client_ip: Client IP address
+            
+        Returns:
+            Tuple of (is_allowed, retry_after_seconds)
+        """
+        now = time.monotonic_ns()
+        current = now // self.sub_window_ns
+        state = self.windows.get(client_ip)
         
-        # Check if under limit
-        if len(client_requests) < self.max_requests:
-            client_requests.append(current_time)
+        if state is None:
+            counts = [0] * self.sub_windows
+            counts[current % self.sub_windows] = 1
+            self.windows[client_ip] = [current, counts]
             return True, None
+        
+        last, counts = state
+        # Zero the sub-windows that rotated out since the last request
+        skipped = current - last
+        if skipped >= self.sub_windows:
+            counts[:] = [0] * self.sub_windows
         else:
-            # Calculate retry after time (when oldest request expires)
-            oldest_request = client_requests[0]
-            retry_after = int(oldest_request + self.window_seconds - current_time) + 1
-            return False, retry_after
+            for index in range(last + 1, current + 1):
+                counts[index % self.sub_windows] = 0
+        state[0] = current
+        
+        if sum(counts) < self.max_requests:
+            counts[current % self.sub_windows] += 1
+            return True, None
+        
+        # Retry when the oldest non-empty sub-window leaves the window
+        oldest = current - self.sub_windows + 1
+        while counts[oldest % self.sub_windows] == 0:
+            oldest += 1
+        retry_after = ((oldest + self.sub_windows) * self.sub_window_ns - now) // NS_PER_SECOND + 1
+        return False, retry_after
     
     def cleanup_old_entries(self):
-        """Clean up old entries to prevent memory leaks."""
-        current_time = time.time()
-        cutoff_time = current_time - self.window_seconds
-        
-        # Remove IPs with no recent requests
-        ips_to_remove = []
-        for ip, requests in self.requests.items():
-            while requests and requests[0] <= cutoff_time:
-                requests.popleft()
-            if not requests:
-                ips_to_remove.append(ip)
+        """Drop IPs whose every sub-window has rotated out."""
+        current = time.monotonic_ns() // self.sub_window_ns
+        
+        ips_to_remove = [
+            ip for ip, (last, _) in self.windows.items()
+            if current - last >= self.sub_windows
+        ]
         
         for ip in ips_to_remove:
-            del self.requests[ip]
+            del self.windows[ip]
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """FastAPI middleware for rate limiting."""
+class RedisRateLimiter:
+    """
+    Fixed-window rate limiter backed by Redis.
+    Counts are shared by every worker process, so the limit holds across
+    uvicorn workers and no per-IP state is kept in memory.
+    """
     
-    def __init__(self, app, rate_limiter: Optional[RateLimiter] = None):
-        super().__init__(app)
-        self.rate_limiter = rate_limiter or RateLimiter(
-            max_requests=settings.rate_limit_per_minute,
-            window_seconds=60
-        )
-        self.excluded_paths = {"/docs", "/openapi.json", "/redoc", "/health"}
+    def __init__(self, redis_url: str, max_requests: int = 100, window_seconds: int = 60):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.redis = aioredis.Redis.from_url(redis_url)
     
-    async def dispatch(self, request: Request, call_next):
+    async def is_allowed(self, client_ip: str) -> tuple[bool, Optional[int]]:
+        """
+        Check if request is allowed for given IP.
+        
+        Args:
+            client_ip: Client IP address
+            
+        Returns:
+            Tuple of (is_allowed, retry_after_seconds)
+        """
+        current_time = int(time.time())
+        window = current_time // self.window_seconds
+        key = f"rl:{client_ip}:{window}"
+        
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.incr(key)
+                pipe.expire(key, self.window_seconds)
+                count, _ = await pipe.execute()
+        except RedisError as e:
+            # Fail open: an unavailable limiter must not take the API down
+            logger.error("Redis rate limiter unavailable: %s", e)
+            return True, None
+        
+        if count <= self.max_requests:
+            return True, None
+        
+        # Retry once the current window rolls over
+        retry_after = (window + 1) * self.window_seconds - current_time
+        return False, max(retry_after, 1)
+    
+    def cleanup_old_entries(self):
+        """Keys expire in Redis on their own; nothing to clean up locally."""
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware for rate limiting, reading the client IP straight from the scope."""
+    
+    def __init__(self, app: ASGIApp, rate_limiter: Optional[Union[RateLimiter, SlidingWindowRateLimiter, RedisRateLimiter]] = None):
+        self.app = app
+        self.rate_limiter = rate_limiter or create_rate_limiter()
+        self.excluded_paths = frozenset({"/docs", "/openapi.json", "/redoc", "/health"})
+        self._request_count = 0
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Process request through rate limiter."""
         
-        # Skip rate limiting for excluded paths
-        if request.url.path in self.excluded_paths:
-            return await call_next(request)
+        # Skip rate limiting for non-HTTP traffic and excluded paths
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
         
         # Get client IP
-        client_ip = self._get_client_ip(request)
+        client_ip = self._get_client_ip(scope)
         
         # Check rate limit
-        is_allowed, retry_after = self.rate_limiter.is_allowed(client_ip)
+        result = self.rate_limiter.is_allowed(client_ip)
+        if inspect.isawaitable(result):
+            result = await result
+        is_allowed, retry_after = result
+        
+        # Periodic cleanup, driven by a request counter rather than the wall clock.
+        # Counted before the branch so throttled clients and failing requests count too
+        self._request_count += 1
+        if self._request_count >= CLEANUP_INTERVAL_REQUESTS:
+            self._request_count = 0
+            self.rate_limiter.cleanup_old_entries()
         
         if not is_allowed:
-            logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-            return JSONResponse(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                content={
-                    "error": "Rate limit exceeded",
-                    "message": f"Too many requests. Limit: {settings.rate_limit_per_minute} per minute",
-                    "retry_after": retry_after,
-                    "postman_collection": settings.postman_collection_url,
-                    "swagger_docs": settings.swagger_docs_url
-                },
-                headers={"Retry-After": str(retry_after)}
-            )
+            logger.warning("Rate limit exceeded for IP: %s", client_ip)
+            retry_after_bytes = str(retry_after).encode()
+            body = _RATE_LIMIT_BODY_TEMPLATE.replace(_RETRY_AFTER_PLACEHOLDER, retry_after_bytes)
+            await send({
+                "type": "http.response.start",
+                "status": status.HTTP_429_TOO_MANY_REQUESTS,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", retry_after_bytes)
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
         
         # Proceed with request
-        response = await call_next(request)
-        
-        # Periodic cleanup (every 100th request)
-        if time.time() % 100 < 1:
-            self.rate_limiter.cleanup_old_entries()
-        
-        return response
+        await self.app(scope, receive, send)
     
-    def _get_client_ip(self, request: Request) -> str:
-        """Extract client IP from request headers."""
+    def _get_client_ip(self, scope: Scope) -> str:
+        """Extract client IP from the raw ASGI headers in a single scan."""
+        forwarded_for = None
+        real_ip = None
+        for name, value in scope["headers"]:
+            # ASGI header names are already lowercased bytes
+            if name == b"x-forwarded-for" and forwarded_for is None:
+                forwarded_for = value
+            elif name == b"x-real-ip" and real_ip is None:
+                real_ip = value
+        
         # Check for forwarded headers (for reverse proxies)
-        forwarded_for = request.headers.get("X-Forwarded-For")
         if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
+            return forwarded_for.decode("latin-1").split(",")[0].strip()
         
-        real_ip = request.headers.get("X-Real-IP")
         if real_ip:
-            return real_ip
+            return real_ip.decode("latin-1")
         
         # Fallback to direct client IP
-        if request.client:
-            return request.client.host
+        client = scope.get("client")
+        if client:
+            return client[0]
         
         return "unknown"
 
 
+def create_rate_limiter() -> Union[RateLimiter, SlidingWindowRateLimiter, RedisRateLimiter]:
+    """
+    Build the configured limiter: Redis when REDIS_URL is set, otherwise the
+    in-process strategy selected by RATE_LIMIT_STRATEGY.
+    """
+    if settings.redis_url:
+        return RedisRateLimiter(
+            settings.redis_url,
+            max_requests=settings.rate_limit_per_minute,
+            window_seconds=60
+        )
+    if settings.rate_limit_strategy == "sliding_window":
+        return SlidingWindowRateLimiter(
+            max_requests=settings.rate_limit_per_minute,
+            window_seconds=60
+        )
+    return RateLimiter(
+        max_requests=settings.rate_limit_per_minute,
+        window_seconds=60
+    )
+
+
 # Global rate limiter instance
-rate_limiter = RateLimiter(
-    max_requests=settings.rate_limit_per_minute,
-    window_seconds=60
-)
+rate_limiter = create_rate_limiter()
@@ -3,16 +3,25 @@ Database models and operations for the debate bot application.
 Handles SQLite database with conversations and messages tables.
 """
 
+import logging
 import sqlite3
+import threading
 import uuid
-from datetime import datetime
-from typing import List, Optional, Dict, Any
-from sqlalchemy import create_engine, Column, String, Integer, Text, DateTime, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Sequence, Tuple
+from cachetools import LRUCache
+from sqlalchemy import create_engine, event, func, select, update, String, Integer, Text, DateTime, ForeignKey, Index
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker, Session, relationship
+from sqlalchemy.pool import StaticPool
 from app.config import settings
+from app.middleware import DatabaseError
 
-Base = declarative_base()
+logger = logging.getLogger(__name__)
+
+
+class Base(DeclarativeBase):
+    """Declarative base for the application's ORM models."""
 
 
 class Conversation(Base):
@@ -20,16 +29,16 @@ class Conversation(Base):
     
     __tablename__ = "conversations"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    topic = Column(String, nullable=False)
-    bot_position = Column(Text, nullable=False)
-    original_topic = Column(Text, nullable=False)  # Store the original user message that started the debate
-    max_turns = Column(Integer, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    id: Mapped[str] = mapped_column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    topic: Mapped[str] = mapped_column(String, nullable=False)
+    bot_position: Mapped[str] = mapped_column(Text, nullable=False)
+    original_topic: Mapped[str] = mapped_column(Text, nullable=False)  # Store the original user message that started the debate
+    max_turns: Mapped[Optional[int]] = mapped_column(Integer, default=0)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship to messages
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    messages: Mapped[List["Message"]] = relationship(back_populates="conversation", cascade="all, delete-orphan")
 
 
 class Message(Base):
@@ -37,15 +46,20 @@ class Message(Base):
     
     __tablename__ = "messages"
     
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
-    turn = Column(Integer, nullable=False)
-    role = Column(String, nullable=False)  # 'user' or 'bot'
-    message = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    conversation_id: Mapped[str] = mapped_column(String, ForeignKey("conversations.id"), nullable=False)
+    turn: Mapped[int] = mapped_column(Integer, nullable=False)
+    role: Mapped[str] = mapped_column(String, nullable=False)  # 'user' or 'bot'
+    message: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationship to conversation
-    conversation = relationship("Conversation", back_populates="messages")
+    conversation: Mapped["Conversation"] = relationship(back_populates="messages")
+    
+    # Serves history and per-turn lookups as an index range, already in ORDER BY order
+    __table_args__ = (
+        Index("ix_messages_conv_turn_created", "conversation_id", "turn", "created_at"),
+    )
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -54,17 +68,80 @@ class Message(Base):
             raise ValueError("Role must be 'user' or 'bot'")
 
 
+# Read paths select plain columns: rows come back as mappings without
+# hydrating ORM instances (or re-running Message's role validation)
+# Fixed when the conversation is created, so safe to keep in memory
+_STATIC_CONVERSATION_COLUMNS = (
+    Conversation.id,
+    Conversation.topic,
+    Conversation.bot_position,
+    Conversation.original_topic,
+    Conversation.created_at,
+)
+# Advanced by whichever worker stores a turn, so always read from the database
+_TURN_CONVERSATION_COLUMNS = (Conversation.max_turns, Conversation.updated_at)
+_CONVERSATION_COLUMNS = _STATIC_CONVERSATION_COLUMNS + _TURN_CONVERSATION_COLUMNS
+# Exactly the MessageSchema fields, so history rows can be returned as-is
+_MESSAGE_COLUMNS = (Message.turn, Message.role, Message.message)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune each new SQLite connection: WAL for concurrent readers, larger in-memory caches."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.close()
+
+
+def _create_engine(database_url: str) -> Engine:
+    """Create the engine with a connection pool suited to the database backend."""
+    echo = settings.log_level == "DEBUG"
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(database_url, echo=echo)
+    
+    # Shared across the threads that run database calls; wait on locks instead of failing
+    connect_args = {"check_same_thread": False, "timeout": 30}
+    if url.database in (None, "", ":memory:"):
+        # One connection, otherwise every pooled connection would see its own empty database
+        return create_engine(database_url, echo=echo, connect_args=connect_args, poolclass=StaticPool)
+    # File databases keep QueuePool: connections (and the WAL) stay open between sessions
+    return create_engine(database_url, echo=echo, connect_args=connect_args)
+
+
 class DatabaseManager:
     """Database manager for handling all database operations."""
     
-    def __init__(self):
-        self.engine = create_engine(settings.database_url, echo=settings.log_level == "DEBUG")
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+    def __init__(self, engine: Optional[Engine] = None):
+        """
+        Args:
+            engine: Engine to use as is; by default one is built from settings.database_url
+        """
+        if engine is None:
+            engine = _create_engine(settings.database_url)
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _set_sqlite_pragmas)
+        self.engine = engine
+        # Nothing reads ORM objects after commit, so skip expiring and reloading them
+        self.SessionLocal = sessionmaker(
+            autocommit=False, autoflush=False, expire_on_commit=False, bind=self.engine
+        )
+        # conversation_id -> static columns of known conversations. Other workers
+        # and instances write turns too, so max_turns and updated_at are never cached
+        self._conversation_cache: LRUCache = LRUCache(maxsize=settings.conversation_cache_size)
+        # The service calls into the manager from worker threads; LRUCache is not thread-safe
+        self._cache_lock = threading.Lock()
         self.create_tables()
     
     def create_tables(self):
         """Create all database tables."""
         Base.metadata.create_all(bind=self.engine)
+        # create_all skips indexes of tables that already exist
+        for index in Message.__table__.indexes:
+            index.create(bind=self.engine, checkfirst=True)
     
     def get_session(self) -> Session:
         """Get a database session."""
@@ -80,28 +157,37 @@ class DatabaseManager:
             )
             session.add(conversation)
             session.commit()
-            session.refresh(conversation)
+            row = {column.key: getattr(conversation, column.key) for column in _STATIC_CONVERSATION_COLUMNS}
+            with self._cache_lock:
+                self._conversation_cache[conversation.id] = row
             return conversation.id
     
     def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
         """Get conversation by ID."""
+        with self._cache_lock:
+            cached = self._conversation_cache.get(conversation_id)
+        
         with self.get_session() as session:
-            conversation = session.query(Conversation).filter(
-                Conversation.id == conversation_id
-            ).first()
+            if cached is not None:
+                # Known conversation: only the turn columns have to be fetched
+                row = session.execute(
+                    select(*_TURN_CONVERSATION_COLUMNS).where(Conversation.id == conversation_id)
+                ).mappings().first()
+                return {**cached, **row} if row else None
             
-            if not conversation:
+            row = session.execute(
+                select(*_CONVERSATION_COLUMNS).where(Conversation.id == conversation_id)
+            ).mappings().first()
+            
+            if not row:
                 return None
             
-            return {
-                "id": conversation.id,
-                "topic": conversation.topic,
-                "bot_position": conversation.bot_position,
-                "original_topic": conversation.original_topic,
-                "max_turns": conversation.max_turns,
-                "created_at": conversation.created_at,
-                "updated_at": conversation.updated_at
-            }
+            conversation = dict(row)
+            with self._cache_lock:
+                self._conversation_cache[conversation_id] = {
+                    column.key: conversation[column.key] for column in _STATIC_CONVERSATION_COLUMNS
+                }
+            return conversation
     
     def add_message(self, conversation_id: str, turn: int, role: str, message: str) -> bool:
         """Add a message to a conversation."""
@@ -116,14 +202,18 @@ class DatabaseManager:
                 )
                 session.add(new_message)
                 
-                # Update max_turns if this is a bot message (end of turn)
+                # Update max_turns if this is a bot message (end of turn), in a
+                # single UPDATE instead of loading the conversation first
                 if role == "bot":
-                    conversation = session.query(Conversation).filter(
-                        Conversation.id == conversation_id
-                    ).first()
-                    if conversation:
-                        conversation.max_turns = max(conversation.max_turns, turn)
-                        conversation.updated_at = datetime.utcnow()
+                    now = datetime.utcnow()
+                    session.execute(
+                        update(Conversation)
+                        .where(Conversation.id == conversation_id)
+                        .values(
+                            max_turns=func.max(Conversation.max_turns, turn),
+                            updated_at=now
+                        )
+                    )
                 
                 session.commit()
                 return True
@@ -132,50 +222,87 @@ class DatabaseManager:
                 print(f"Error adding message: {e}")
                 return False
     
+    def add_messages(self, conversation_id: str, rows: Sequence[Tuple[int, str, str]]) -> bool:
+        """
+        Add several (turn, role, message) rows in one transaction.
+        
+        The ORM batches the rows into a single multi-row INSERT, and max_turns
+        is bumped once for the latest bot turn among them.
+        
+        Raises:
+            DatabaseError: If the rows could not be stored; none of them are kept
+        """
+        with self.get_session() as session:
+            try:
+                # Rows share a commit, so space their timestamps to keep the
+                # given order under ORDER BY turn, created_at
+                now = datetime.utcnow()
+                session.add_all([
+                    Message(
+                        conversation_id=conversation_id,
+                        turn=turn,
+                        role=role,
+                        message=message,
+                        created_at=now + timedelta(microseconds=offset)
+                    )
+                    for offset, (turn, role, message) in enumerate(rows)
+                ])
+                
+                bot_turns = [turn for turn, role, _ in rows if role == "bot"]
+                if bot_turns:
+                    session.execute(
+                        update(Conversation)
+                        .where(Conversation.id == conversation_id)
+                        .values(
+                            max_turns=func.max(Conversation.max_turns, max(bot_turns)),
+                            updated_at=now
+                        )
+                    )
+                
+                session.commit()
+                return True
+            except Exception as e:
+                session.rollback()
+                logger.error("Error adding messages to conversation %s: %s", conversation_id, e)
+                raise DatabaseError(f"Failed to store messages for conversation {conversation_id}") from e
+    
     def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
         """Get all messages for a conversation ordered by turn and creation time."""
         with self.get_session() as session:
-            messages = session.query(Message).filter(
-                Message.conversation_id == conversation_id
-            ).order_by(Message.turn, Message.created_at).all()
+            rows = session.execute(
+                select(*_MESSAGE_COLUMNS)
+                .where(Message.conversation_id == conversation_id)
+                .order_by(Message.turn, Message.created_at)
+            ).mappings().all()
             
-            return [
-                {
-                    "turn": msg.turn,
-                    "role": msg.role,
-                    "message": msg.message,
-                    "created_at": msg.created_at
-                }
-                for msg in messages
-            ]
+            return [dict(row) for row in rows]
     
     def get_current_turn_messages(self, conversation_id: str, turn: int) -> List[Dict[str, Any]]:
         """Get messages for a specific turn."""
         with self.get_session() as session:
-            messages = session.query(Message).filter(
-                Message.conversation_id == conversation_id,
-                Message.turn == turn
-            ).order_by(Message.created_at).all()
+            rows = session.execute(
+                select(*_MESSAGE_COLUMNS)
+                .where(Message.conversation_id == conversation_id, Message.turn == turn)
+                .order_by(Message.created_at)
+            ).mappings().all()
             
-            return [
-                {
-                    "turn": msg.turn,
-                    "role": msg.role,
-                    "message": msg.message,
-                    "created_at": msg.created_at
-                }
-                for msg in messages
-            ]
+            return [dict(row) for row in rows]
     
     def get_next_turn(self, conversation_id: str) -> int:
         """Get the next turn number for a conversation."""
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
-            return 1
-        return conversation["max_turns"] + 1
+        # Always read max_turns from the database: other workers and instances
+        # advance it too, so a copy held by this process can be stale
+        with self.get_session() as session:
+            max_turns = session.execute(
+                select(Conversation.max_turns).where(Conversation.id == conversation_id)
+            ).scalar_one_or_none()
+        return (max_turns or 0) + 1
     
     def conversation_exists(self, conversation_id: str) -> bool:
         """Check if a conversation exists."""
+        with self._cache_lock:
+            if conversation_id in self._conversation_cache:
+                return True
         return self.get_conversation(conversation_id) is not None
 
 
@@ -3,8 +3,8 @@ Pydantic schemas for request/response validation and serialization.
 Implements strict validation according to the work-plan requirements.
 """
 
-from typing import List, Optional, Union
-from pydantic import BaseModel, Field, field_validator
+from typing import List, Literal, Optional, Union
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from app.config import settings
 
 
@@ -32,15 +32,17 @@ class ChatRequest(BaseModel):
             return None
         return v
     
-    class Config:
+    model_config = ConfigDict(
         # Forbid extra attributes - only conversation_id and message allowed
-        extra = "forbid"
-        json_schema_extra = {
+        extra="forbid",
+        frozen=True,
+        json_schema_extra={
             "example": {
                 "conversation_id": "abc123-def456-ghi789",
                 "message": "I think climate change is caused by humans"
             }
         }
+    )
 
 
 class MessageSchema(BaseModel):
@@ -49,6 +51,8 @@ class MessageSchema(BaseModel):
     role: str = Field(..., description="Message role (user or bot)")
     message: str = Field(..., description="Message content")
     
+    model_config = ConfigDict(frozen=True)
+    
     @field_validator('role')
     @classmethod
     def validate_role(cls, v):
@@ -66,8 +70,9 @@ class ChatResponse(BaseModel):
     messages: List[MessageSchema] = Field(..., description="Current turn messages (user + bot)")
     conversation_history: List[MessageSchema] = Field(..., description="All messages ordered by turn")
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        frozen=True,
+        json_schema_extra={
             "example": {
                 "conversation_id": "abc123-def456-ghi789",
                 "messages": [
@@ -106,6 +111,29 @@ class ChatResponse(BaseModel):
                 ]
             }
         }
+    )
+
+
+class TaskResponse(BaseModel):
+    """Status of a background chat task started with /chat?mode=async."""
+    task_id: str = Field(..., description="Task ID to poll")
+    status: Literal["pending", "completed", "failed"] = Field(..., description="Task status")
+    conversation_id: Optional[str] = Field(None, description="Conversation ID (known up front when continuing a conversation)")
+    result: Optional[ChatResponse] = Field(None, description="Chat response once the task has completed")
+    error: Optional[str] = Field(None, description="Error message if the task failed")
+    
+    model_config = ConfigDict(
+        frozen=True,
+        json_schema_extra={
+            "example": {
+                "task_id": "5f0c8a1e-2b7d-4c3a-9e61-0d2f4b8a7c15",
+                "status": "pending",
+                "conversation_id": "abc123-def456-ghi789",
+                "result": None,
+                "error": None
+            }
+        }
+    )
 
 
 class ErrorResponse(BaseModel):
@@ -115,8 +143,9 @@ class ErrorResponse(BaseModel):
     postman_collection: Optional[str] = Field(None, description="URL to Postman collection")
     swagger_docs: str = Field(..., description="URL to Swagger documentation")
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        frozen=True,
+        json_schema_extra={
             "example": {
                 "error": "Invalid request format",
                 "message": "Only 'conversation_id' and 'message' attributes are allowed",
@@ -124,6 +153,7 @@ class ErrorResponse(BaseModel):
                 "swagger_docs": "https://api.example.com/docs"
             }
         }
+    )
 
 
 class HealthResponse(BaseModel):
@@ -132,11 +162,13 @@ class HealthResponse(BaseModel):
     timestamp: str = Field(..., description="Current timestamp")
     version: str = Field(..., description="Application version")
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        frozen=True,
+        json_schema_extra={
             "example": {
                 "status": "healthy",
                 "timestamp": "2024-01-15T10:30:00Z",
                 "version": "1.0.0"
             }
-        }
\ No newline at end of file
+        }
+    )
\ No newline at end of file
@@ -5,8 +5,10 @@ Contains business logic services for conversation management and external API ha
 
 from .conversation_service import conversation_service
 from .retry_service import openai_client
+from .task_service import task_service
 
 __all__ = [
     "conversation_service",
-    "openai_client"
+    "openai_client",
+    "task_service"
 ]
\ No newline at end of file
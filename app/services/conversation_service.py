@@ -3,12 +3,17 @@ Conversation service for managing debate conversations with turn management and
 Orchestrates the entire conversation flow from topic analysis to response generation.
 """
 
-from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import random
+from functools import cached_property
+from typing import Dict, Any, List, Optional, Set, Tuple, AsyncIterator
+from cachetools import LRUCache
+from app.config import settings
 from app.models.database import db_manager
 from app.chains import (
-    topic_analysis_chain,
-    persuasive_response_chain,
-    consistency_validation_chain
+    get_topic_analysis_chain,
+    get_persuasive_response_chain,
+    get_consistency_validation_chain
 )
 from app.utils.validators import response_validator
 from app.utils.fallbacks import fallback_generator
@@ -18,25 +23,44 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+PASS_RATE_SMOOTHING = 0.1  # EMA weight of each new validation outcome
+INITIAL_PASS_RATE = 0.5  # Unknown positions start undecided
+CONFIDENT_PASS_RATE = 0.9  # Above this a single validation attempt is enough
+MAX_TRACKED_POSITIONS = 10000
+
 
 class ConversationService:
     """Service for managing debate conversations and AI chain orchestration."""
     
     def __init__(self):
-        """Initialize the conversation service with chain instances and validators."""
-        # Initialize chain instances
-        self.topic_analysis = topic_analysis_chain
-        self.persuasive_response = persuasive_response_chain
-        self.consistency_validation = consistency_validation_chain
-        
+        """Initialize the conversation service with validators; chains are resolved lazily."""
         # Initialize validators and fallbacks
         self.response_validator = response_validator
         self.fallback_generator = fallback_generator
         
         # Configuration
         self.max_validation_attempts = 3
+        self.candidates_per_attempt = settings.candidates_per_attempt  # Parallel generations voted on by the validators
+        self._audit_tasks: Set[asyncio.Task] = set()  # In-flight sampled consistency audits
+        # bot_position -> EMA of the share of candidates that pass validation; keyed on
+        # the position alone because it recurs across conversations, unlike the topic
+        self._pass_rates: LRUCache = LRUCache(maxsize=MAX_TRACKED_POSITIONS)
+    
+    # Chain instances are looked up on first use so constructing the service
+    # (at import time) does not build any LLM clients
+    @cached_property
+    def topic_analysis(self):
+        return get_topic_analysis_chain()
+    
+    @cached_property
+    def persuasive_response(self):
+        return get_persuasive_response_chain()
     
-    def start_new_conversation(self, user_message: str) -> Dict[str, Any]:
+    @cached_property
+    def consistency_validation(self):
+        return get_consistency_validation_chain()
+    
+    async def start_new_conversation(self, user_message: str) -> Dict[str, Any]:
         """
         Start a new conversation by analyzing topic and assigning position.
         
@@ -47,72 +71,57 @@ class ConversationService:
             Dictionary with conversation_id, topic info, and initial response
         """
         try:
-            logger.info(f"[CONVERSATION_SERVICE] START_NEW_CONVERSATION: user_message='{user_message}'")
+            logger.info("[CONVERSATION_SERVICE] START_NEW_CONVERSATION: user_message='%s'", user_message)
             
             # Step 1: Analyze topic and generate bot position
             logger.info("[CONVERSATION_SERVICE] Step 1: Analyzing topic and generating bot position")
-            topic_data = self.topic_analysis.analyze_topic(user_message)
-            logger.info(f"[CONVERSATION_SERVICE] Topic analysis result: {topic_data}")
+            topic_data = await self.topic_analysis.analyze_topic(user_message)
+            logger.info("[CONVERSATION_SERVICE] Topic analysis result: %s", topic_data)
             
-            # Step 2: Create conversation in database with original topic
-            logger.info("[CONVERSATION_SERVICE] Step 2: Creating conversation in database")
-            conversation_id = db_manager.create_conversation(
-                topic=topic_data["topic"],
-                bot_position=topic_data["bot_position"],
-                original_topic=user_message  # Store the original user message
+            # Step 2: Create the conversation row while the initial response is
+            # generated; both only depend on the topic analysis
+            logger.info("[CONVERSATION_SERVICE] Step 2: Creating conversation and generating initial bot response")
+            conversation_id, bot_response = await asyncio.gather(
+                asyncio.to_thread(
+                    db_manager.create_conversation,
+                    topic=topic_data["topic"],
+                    bot_position=topic_data["bot_position"],
+                    original_topic=user_message  # Store the original user message
+                ),
+                self._generate_response(
+                    user_message=user_message,
+                    topic_data=topic_data,
+                    position=topic_data["bot_position"],
+                    conversation_history=[]
+                )
             )
-            logger.info(f"[CONVERSATION_SERVICE] Conversation created with ID: {conversation_id}")
-            
-            # Step 4: Add user message (turn 1)
-            db_manager.add_message(conversation_id, 1, "user", user_message)
-            logger.info("[CONVERSATION_SERVICE] User message added to database")
+            logger.info("[CONVERSATION_SERVICE] Conversation created with ID: %s", conversation_id)
+            logger.info("[CONVERSATION_SERVICE] Bot response generated: %s", bot_response)
             
-            # Step 5: Generate initial response
-            logger.info("[CONVERSATION_SERVICE] Step 5: Generating initial bot response")
-            bot_response = self._generate_response(
-                user_message=user_message,
-                topic_data=topic_data,
-                position=topic_data["bot_position"],
-                conversation_history=[]
+            # Step 3: Store the whole turn (user + bot) in one transaction
+            await asyncio.to_thread(
+                db_manager.add_messages, conversation_id, [(1, "user", user_message), (1, "bot", bot_response)]
             )
-            logger.info(f"[CONVERSATION_SERVICE] Bot response generated: {bot_response}")
-            
-            # Step 6: Add bot message (turn 1)
-            db_manager.add_message(conversation_id, 1, "bot", bot_response)
-            logger.info("[CONVERSATION_SERVICE] Bot message added to database")
+            logger.info("[CONVERSATION_SERVICE] Turn 1 messages added to database")
             
-            # Step 7: Prepare response
-            current_messages = db_manager.get_current_turn_messages(conversation_id, 1)
-            conversation_history = db_manager.get_conversation_history(conversation_id)
+            # Step 4: Prepare response from the rows just written instead of re-reading them
+            current_messages = self._turn_messages(1, user_message, bot_response)
             
             result = {
                 "conversation_id": conversation_id,
-                "messages": [
-                    {
-                        "turn": msg["turn"],
-                        "role": msg["role"],
-                        "message": msg["message"]
-                    }
-                    for msg in current_messages
-                ],
-                "conversation_history": [
-                    {
-                        "turn": msg["turn"],
-                        "role": msg["role"],
-                        "message": msg["message"]
-                    }
-                    for msg in conversation_history
-                ]
+                "messages": current_messages,
+                "conversation_history": list(current_messages)
             }
             
-            logger.info(f"[CONVERSATION_SERVICE] Final result: {result}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[CONVERSATION_SERVICE] Final result: %s", result)
             return result
             
         except Exception as e:
-            logger.error(f"[CONVERSATION_SERVICE] Error starting new conversation: {e}")
+            logger.error("[CONVERSATION_SERVICE] Error starting new conversation: %s", e)
             raise AIServiceError("Failed to start new conversation")
     
-    def continue_conversation(self, conversation_id: str, user_message: str) -> Dict[str, Any]:
+    async def continue_conversation(self, conversation_id: str, user_message: str) -> Dict[str, Any]:
         """
         Continue an existing conversation with a new user message.
         
@@ -125,21 +134,22 @@ class ConversationService:
         """
         try:
             # Step 1: Validate conversation exists
-            conversation = db_manager.get_conversation(conversation_id)
+            conversation = await asyncio.to_thread(db_manager.get_conversation, conversation_id)
             if not conversation:
                 raise ConversationNotFoundError(f"Conversation {conversation_id} not found")
             
-            # Step 2: Get next turn number
-            next_turn = db_manager.get_next_turn(conversation_id)
+            # Step 2: Next turn number, from the max_turns just read with the conversation
+            next_turn = (conversation["max_turns"] or 0) + 1
             
-            # Step 3: Add user message
-            db_manager.add_message(conversation_id, next_turn, "user", user_message)
+            # Step 3: Get conversation history and add the new user message for context;
+            # it is stored together with the bot reply once generation finishes
+            stored_history = await asyncio.to_thread(db_manager.get_conversation_history, conversation_id)
+            conversation_history = stored_history + [
+                {"turn": next_turn, "role": "user", "message": user_message}
+            ]
             
-            # Step 4: Get conversation history for context
-            conversation_history = db_manager.get_conversation_history(conversation_id)
-            
-            # Step 5: Generate bot response using original topic as reference
-            bot_response = self._generate_response(
+            # Step 4: Generate bot response using original topic as reference
+            bot_response = await self._generate_response(
                 user_message=user_message,
                 position=conversation["bot_position"],
                 conversation_history=conversation_history,
@@ -149,39 +159,123 @@ class ConversationService:
                 original_topic=conversation["original_topic"]  # Pass original topic for consistency
             )
             
-            # Step 6: Add bot message
-            db_manager.add_message(conversation_id, next_turn, "bot", bot_response)
+            # Step 5: Store the whole turn (user + bot) in one transaction
+            await asyncio.to_thread(
+                db_manager.add_messages,
+                conversation_id,
+                [(next_turn, "user", user_message), (next_turn, "bot", bot_response)]
+            )
             
-            # Step 7: Prepare response
-            current_messages = db_manager.get_current_turn_messages(conversation_id, next_turn)
-            updated_history = db_manager.get_conversation_history(conversation_id)
+            # Step 6: Prepare response from the history already in hand plus this turn
+            current_messages = self._turn_messages(next_turn, user_message, bot_response)
+            updated_history = stored_history + current_messages
             
             return {
                 "conversation_id": conversation_id,
-                "messages": [
-                    {
-                        "turn": msg["turn"],
-                        "role": msg["role"],
-                        "message": msg["message"]
-                    }
-                    for msg in current_messages
-                ],
-                "conversation_history": [
-                    {
-                        "turn": msg["turn"],
-                        "role": msg["role"],
-                        "message": msg["message"]
-                    }
-                    for msg in updated_history
-                ]
+                "messages": current_messages,
+                "conversation_history": updated_history
             }
             
+        except ConversationNotFoundError:
+            # Client error (404), not an AI service failure
+            raise
         except Exception as e:
-            logger.error(f"Error continuing conversation {conversation_id}: {e}")
+            logger.error("Error continuing conversation %s: %s", conversation_id, e)
             raise AIServiceError("Failed to continue conversation")
     
-    def _generate_response(
-        self, 
+    async def stream_conversation(
+        self,
+        conversation_id: Optional[str],
+        user_message: str
+    ) -> Tuple[str, AsyncIterator[str]]:
+        """
+        Start or continue a conversation and stream the bot reply.
+
+        Setup (topic analysis or conversation lookup) runs eagerly so errors
+        surface before any bytes are sent. The returned iterator yields response
+        chunks as they arrive and stores the user message and the full bot reply
+        together once the stream closes.
+
+        Unlike the non-streaming path, the reply is not validated: there is no
+        self-check, response validator, consistency audit or retry, because
+        chunks are already sent by the time the text is complete. The position
+        fallback is only used when the stream fails before yielding anything.
+
+        Args:
+            conversation_id: ID of existing conversation, or None to start a new one
+            user_message: The user message
+
+        Returns:
+            Tuple of (conversation_id, iterator of response chunks)
+        """
+        if conversation_id:
+            conversation = await asyncio.to_thread(db_manager.get_conversation, conversation_id)
+            if not conversation:
+                raise ConversationNotFoundError(f"Conversation {conversation_id} not found")
+
+            turn = (conversation["max_turns"] or 0) + 1
+            stored_history = await asyncio.to_thread(
+                db_manager.get_conversation_history, conversation_id
+            )
+            history = stored_history + [{"turn": turn, "role": "user", "message": user_message}]
+            topic = conversation["topic"]
+            bot_position = conversation["bot_position"]
+        else:
+            topic_data = await self.topic_analysis.analyze_topic(user_message)
+            conversation_id = await asyncio.to_thread(
+                db_manager.create_conversation,
+                topic=topic_data["topic"],
+                bot_position=topic_data["bot_position"],
+                original_topic=user_message
+            )
+            turn = 1
+            history = []
+            topic = topic_data["topic"]
+            bot_position = topic_data["bot_position"]
+
+        async def chunks() -> AsyncIterator[str]:
+            parts: List[str] = []
+            try:
+                async for chunk in self.persuasive_response.astream_response(
+                    user_message=user_message,
+                    topic=topic,
+                    bot_position=bot_position,
+                    conversation_history=history
+                ):
+                    parts.append(chunk)
+                    yield chunk
+            except Exception as e:
+                logger.error(
+                    "[CONVERSATION_SERVICE] Streaming failed for %s: %s", conversation_id, e
+                )
+                if not parts:
+                    fallback = self.fallback_generator.get_fallback_response(
+                        topic=topic, position=bot_position, user_message=user_message
+                    )
+                    parts.append(fallback)
+                    yield fallback
+            finally:
+                if parts:
+                    # Store the whole turn in one transaction; shielded so a client
+                    # disconnect cancelling the stream does not abandon the write
+                    await asyncio.shield(asyncio.to_thread(
+                        db_manager.add_messages,
+                        conversation_id,
+                        [(turn, "user", user_message), (turn, "bot", "".join(parts).strip())]
+                    ))
+
+        return conversation_id, chunks()
+
+    @staticmethod
+    def _turn_messages(turn: int, user_message: str, bot_response: str) -> List[Dict[str, Any]]:
+        """Build the response view of one completed turn."""
+        return [
+            {"turn": turn, "role": "user", "message": user_message},
+            {"turn": turn, "role": "bot", "message": bot_response}
+        ]
+    
+    async def _generate_response(
+        self,
         user_message: str,
         topic_data: Optional[Dict[str, Any]] = None,
         position: Optional[str] = None,
@@ -225,63 +319,149 @@ class ConversationService:
                 topic = "General Discussion"
             
             history = conversation_history or []
+            max_attempts = self._attempts_for(bot_position)
             
             # Generate response with validation loop
-            for attempt in range(self.max_validation_attempts):
+            for attempt in range(max_attempts):
                 try:
-                    # Generate response
-                    generated_response = self.persuasive_response.generate_response(
-                        user_message=user_message,
-                        topic=topic,
-                        bot_position=bot_position,
-                        conversation_history=history
-                    )
-                    
-                    # Validate response
-                    validation_result = self.consistency_validation.validate_response(
-                        bot_response=generated_response,
-                        bot_position=bot_position,
-                        conversation_history=history
+                    # Generate several candidates concurrently and let the validators vote
+                    candidates = await self._generate_candidates(
+                        user_message, topic, bot_position, history, self.candidates_per_attempt
                     )
                     
-                    # Additional validation with our validators
-                    validator_result = self.response_validator.comprehensive_validation(
-                        generated_response, bot_position
-                    )
-                    
-                    # Log validation results for debugging
-                    logger.info(f"[CONVERSATION_SERVICE] VALIDATION_RESULTS attempt {attempt + 1}: consistency={validation_result.get('is_consistent')}, approved={validation_result.get('approved')}, validator_valid={validator_result.get('is_valid')}")
-                    logger.debug(f"[CONVERSATION_SERVICE] CONSISTENCY_VALIDATION: {validation_result}")
-                    logger.debug(f"[CONVERSATION_SERVICE] RESPONSE_VALIDATOR: {validator_result}")
+                    approved = [
+                        (validation_result, generated_response)
+                        for generated_response, validation_result, validator_result in candidates
+                        if validation_result.get("approved", False) and validator_result.get("is_valid", False)
+                    ]
+                    self._record_pass_rate(bot_position, len(approved), len(candidates))
                     
-                    # Check if response passes validation
-                    if validation_result.get("approved", False) and validator_result.get("is_valid", False):
-                        logger.info(f"Response generated successfully on attempt {attempt + 1}")
-                        return generated_response
+                    # Check if any candidate passes validation
+                    if approved:
+                        _, best_response = max(approved, key=lambda item: item[0].get("consistency_score", 0))
+                        logger.info("Response generated successfully on attempt %s", attempt + 1)
+                        return best_response
                     else:
-                        logger.warning(f"Response validation failed on attempt {attempt + 1}")
-                        if attempt == self.max_validation_attempts - 1:
+                        logger.warning("Response validation failed on attempt %s", attempt + 1)
+                        if attempt == max_attempts - 1:
                             # Last attempt failed, use fallback
                             break
                 
                 except Exception as e:
-                    logger.warning(f"Response generation attempt {attempt + 1} failed: {e}")
-                    if attempt == self.max_validation_attempts - 1:
+                    logger.warning("Response generation attempt %s failed: %s", attempt + 1, e)
+                    if attempt == max_attempts - 1:
                         break
             
             # All attempts failed, use fallback
             logger.warning("All response generation attempts failed, using fallback")
-            category = topic_data.get("category", "Other") if topic_data else "Other"
-            return self.fallback_generator.get_fallback_response(category, topic, bot_position, user_message)
+            return self.fallback_generator.get_fallback_response(
+                topic=topic, position=bot_position, user_message=user_message
+            )
             
         except Exception as e:
-            logger.error(f"Critical error in response generation: {e}")
+            logger.error("Critical error in response generation: %s", e)
             # Emergency fallback
             return self.fallback_generator.get_technical_error_response(
                 topic_data.get("topic", "this topic") if topic_data else "this topic",
                 user_message
             )
 
+    def _attempts_for(self, bot_position: str) -> int:
+        """Number of generate/validate attempts to allow for a bot position."""
+        pass_rate = self._pass_rates.get(bot_position, INITIAL_PASS_RATE)
+        if pass_rate > CONFIDENT_PASS_RATE:
+            # Nearly every reply passes here; a retry rarely buys anything over the fallback
+            return 1
+        return self.max_validation_attempts
+    
+    def _record_pass_rate(self, bot_position: str, passed: int, total: int) -> None:
+        """Fold one attempt's validation outcomes into the position's pass rate."""
+        if not total:
+            return
+        pass_rate = self._pass_rates.get(bot_position, INITIAL_PASS_RATE)
+        pass_rate = (1 - PASS_RATE_SMOOTHING) * pass_rate + PASS_RATE_SMOOTHING * (passed / total)
+        self._pass_rates[bot_position] = pass_rate
+        logger.info(
+            "[CONVERSATION_SERVICE] PASS_RATE: %.2f for position %r (%s/%s passed)",
+            pass_rate, bot_position, passed, total
+        )
+    
+    async def _generate_candidates(
+        self,
+        user_message: str,
+        topic: str,
+        bot_position: str,
+        history: List[Dict[str, Any]],
+        count: int
+    ) -> List[Tuple[str, Dict[str, Any], Dict[str, Any]]]:
+        """
+        Generate self-checked candidate responses concurrently and validate them.
+        
+        The generator returns its own consistency verdict with each response, so
+        the separate consistency validator only runs as a sampled audit.
+        
+        Returns:
+            List of (generated_response, consistency_check_result, response_validator_result)
+        """
+        # Generate responses together with their self-check
+        checked_responses = await asyncio.gather(*(
+            self.persuasive_response.generate_checked_response(
+                user_message=user_message,
+                topic=topic,
+                bot_position=bot_position,
+                conversation_history=history
+            )
+            for _ in range(count)
+        ))
+        
+        candidates = []
+        for checked in checked_responses:
+            generated_response = checked["response"]
+            
+            # Additional validation with our validators; only the verdict is used here
+            validator_result = self.response_validator.comprehensive_validation(
+                generated_response, bot_position, fail_fast=True
+            )
+            
+            # Log validation results for debugging
+            logger.info(
+                "[CONVERSATION_SERVICE] VALIDATION_RESULTS: "
+                "self_check_approved=%s, score=%s, validator_valid=%s",
+                checked.get('approved'),
+                checked.get('consistency_score'),
+                validator_result.get('is_valid')
+            )
+            logger.debug("[CONVERSATION_SERVICE] RESPONSE_VALIDATOR: %s", validator_result)
+            
+            candidates.append((generated_response, checked, validator_result))
+        
+        if random.random() < settings.consistency_audit_rate:
+            self._schedule_audit([candidate[0] for candidate in candidates], bot_position, checked_responses)
+        
+        return candidates
+    
+    def _schedule_audit(self, responses: List[str], bot_position: str, self_checks: List[Dict[str, Any]]) -> None:
+        """Run the consistency validator on sampled responses in the background."""
+        task = asyncio.create_task(self._audit_responses(responses, bot_position, self_checks))
+        # Keep a reference so the task is not garbage collected before it finishes
+        self._audit_tasks.add(task)
+        task.add_done_callback(self._audit_tasks.discard)
+    
+    async def _audit_responses(self, responses: List[str], bot_position: str, self_checks: List[Dict[str, Any]]) -> None:
+        """Compare the generator's self-check with the independent validator for quality monitoring."""
+        try:
+            audit_results = await self.consistency_validation.validate_batch([
+                {"bot_response": response, "bot_position": bot_position}
+                for response in responses
+            ])
+            for self_check, audit_result in zip(self_checks, audit_results):
+                if self_check.get("approved") != audit_result.get("approved"):
+                    logger.warning("[CONVERSATION_SERVICE] AUDIT_MISMATCH: self_check=%s, validator=%s", self_check, audit_result)
+                else:
+                    logger.info("[CONVERSATION_SERVICE] AUDIT_AGREES: approved=%s", audit_result.get("approved"))
+        except Exception as e:
+            logger.error("[CONVERSATION_SERVICE] Consistency audit failed: %s", e)
+
 
 # Global service instance
 conversation_service = ConversationService()
@@ -3,16 +3,53 @@ Retry service for handling OpenAI API failures with exponential backoff.
 Implements robust error handling and retry logic for external API calls.
 """
 
-import time
-import random
-from typing import Any, Callable, Dict, Optional
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from openai import OpenAI, RateLimitError, APITimeoutError, APIError, AuthenticationError
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+from tenacity import (
+    AsyncRetrying, RetryCallState, stop_after_attempt, wait_random_exponential,
+    retry_if_exception_type, retry_if_not_exception_type
+)
+from openai import AsyncOpenAI, RateLimitError, APITimeoutError, APIError, AuthenticationError
 from app.config import settings
+from app.chains.llm import get_http_async_client
 import logging
 
 logger = logging.getLogger(__name__)
 
+MAX_RETRY_WAIT_SECONDS = 30
+_RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIError)
+
+# Jittered exponential backoff for errors that carry no server-provided delay
+_backoff = wait_random_exponential(multiplier=0.5, max=MAX_RETRY_WAIT_SECONDS)
+
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Read the delay OpenAI asks for in its Retry-After headers, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date form or garbage; fall back to backoff
+        return None
+    return None
+
+
+def _wait_retry_after_or_backoff(retry_state: RetryCallState) -> float:
+    """Honor the server's Retry-After delay, otherwise back off exponentially."""
+    # The wait runs after a failed attempt, but the outcome is typed as optional
+    outcome = retry_state.outcome
+    error = outcome.exception() if outcome is not None else None
+    retry_after = _retry_after_seconds(error) if error is not None else None
+    if retry_after is not None:
+        return min(max(retry_after, 0.0), MAX_RETRY_WAIT_SECONDS)
+    return _backoff(retry_state)
+
 
 class RetryService:
     """Service for handling retries and error management for OpenAI API calls."""
@@ -22,18 +59,15 @@ class RetryService:
         self.retry_delay = settings.retry_delay_seconds
         self.timeout = settings.openai_timeout_seconds
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        retry=retry_if_exception_type((RateLimitError, APITimeoutError, APIError)),
-        reraise=True
-    )
-    def call_openai_with_retry(self, func: Callable, *args, **kwargs) -> Any:
+    async def call_openai_with_retry(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
         """
         Execute OpenAI API call with retry logic.
         
+        Rate limit, timeout and API errors are retried, waiting for the
+        server's Retry-After delay when it sends one.
+        
         Args:
-            func: The function to call (e.g., client.chat.completions.create)
+            func: The coroutine function to call (e.g., client.chat.completions.create)
             *args, **kwargs: Arguments to pass to the function
             
         Returns:
@@ -43,27 +77,39 @@ class RetryService:
             AuthenticationError: For auth issues (no retry)
             Exception: For other unrecoverable errors
         """
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(self.max_retries),
+            wait=_wait_retry_after_or_backoff,
+            # AuthenticationError subclasses APIError but can never succeed on retry
+            retry=retry_if_exception_type(_RETRYABLE_ERRORS) & retry_if_not_exception_type(AuthenticationError),
+            reraise=True
+        )
+        async for attempt in retrying:
+            with attempt:
+                return await self._call_once(func, *args, **kwargs)
+    
+    @staticmethod
+    async def _call_once(func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Make a single attempt, logging the failure before it reaches the retry policy."""
         try:
-            return func(*args, **kwargs)
+            return await func(*args, **kwargs)
         except AuthenticationError as e:
-            logger.error(f"OpenAI Authentication error: {e}")
+            logger.error("OpenAI Authentication error: %s", e)
             raise  # Don't retry auth errors
         except RateLimitError as e:
-            logger.warning(f"OpenAI Rate limit hit: {e}")
-            # Add jitter to avoid thundering herd
-            time.sleep(random.uniform(1, 3))
-            raise  # Will be retried by tenacity
+            logger.warning("OpenAI Rate limit hit: %s", e)
+            raise  # Retried after the server's Retry-After delay
         except APITimeoutError as e:
-            logger.warning(f"OpenAI Timeout: {e}")
+            logger.warning("OpenAI Timeout: %s", e)
             raise  # Will be retried by tenacity
         except APIError as e:
-            logger.warning(f"OpenAI API error: {e}")
+            logger.warning("OpenAI API error: %s", e)
             raise  # Will be retried by tenacity
         except Exception as e:
-            logger.error(f"Unexpected error calling OpenAI: {e}")
+            logger.error("Unexpected error calling OpenAI: %s", e)
             raise
     
-    def safe_openai_call(self, func: Callable, fallback_value: Any = None, *args, **kwargs) -> tuple[Any, bool]:
+    async def safe_openai_call(self, func: Callable[..., Awaitable[Any]], fallback_value: Any = None, *args, **kwargs) -> tuple[Any, bool]:
         """
         Make a safe OpenAI API call with fallback.
         
@@ -76,13 +122,13 @@ class RetryService:
             Tuple of (result, success_flag)
         """
         try:
-            result = self.call_openai_with_retry(func, *args, **kwargs)
+            result = await self.call_openai_with_retry(func, *args, **kwargs)
             return result, True
         except AuthenticationError:
             logger.error("OpenAI authentication failed - check API key")
             return fallback_value, False
         except Exception as e:
-            logger.error(f"OpenAI call failed after retries: {e}")
+            logger.error("OpenAI call failed after retries: %s", e)
             return fallback_value, False
 
 
@@ -90,17 +136,23 @@ class OpenAIClientManager:
     """Manages OpenAI client with proper configuration and error handling."""
     
     def __init__(self):
-        self.client = OpenAI(
+        self.client = AsyncOpenAI(
             api_key=settings.openai_api_key,
             base_url=settings.openai_base_url,
-            timeout=settings.openai_timeout_seconds
+            timeout=settings.openai_timeout_seconds,
+            http_client=get_http_async_client()  # Same connection pool as the chains
         )
         self.retry_service = RetryService()
+        # Caps in-flight calls made through this manager in one worker
+        self._semaphore = asyncio.Semaphore(settings.max_openai_concurrency)
     
-    def chat_completion(self, messages: list, model: str = "gpt-4o", **kwargs) -> tuple[Optional[str], bool]:
+    async def chat_completion(self, messages: list, model: str = "gpt-4o", **kwargs) -> tuple[Optional[str], bool]:
         """
         Create a chat completion with retry logic.
         
+        Keep static messages first and byte-identical between calls so OpenAI
+        can serve them from its prompt cache.
+        
         Args:
             messages: List of message dicts
             model: OpenAI model to use
@@ -109,20 +161,29 @@ class OpenAIClientManager:
         Returns:
             Tuple of (response_content, success_flag)
         """
-        def _call():
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                **kwargs
-            )
+        async def _call():
+            async with self._semaphore:
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    **kwargs
+                )
+            usage = response.usage
+            details = getattr(usage, "prompt_tokens_details", None)
+            if details is not None:
+                # OpenAI caches identical prompt prefixes automatically; report the hit
+                logger.debug(
+                    "OpenAI cached prompt tokens: %s/%s",
+                    details.cached_tokens or 0, usage.prompt_tokens
+                )
             return response.choices[0].message.content
         
-        return self.retry_service.safe_openai_call(_call, fallback_value=None)
+        return await self.retry_service.safe_openai_call(_call, fallback_value=None)
     
-    def validate_api_key(self) -> bool:
+    async def validate_api_key(self) -> bool:
         """Validate that the OpenAI API key is working."""
         try:
-            response, success = self.chat_completion([
+            response, success = await self.chat_completion([
                 {"role": "user", "content": "Hello"}
             ])
             return success and response is not None
@@ -0,0 +1,109 @@
+"""
+Background task service for chat requests that are polled instead of awaited.
+Runs the conversation pipeline detached from the request and keeps the outcome
+for a while so clients can fetch it by task ID.
+"""
+
+import asyncio
+import uuid
+from typing import Any, Dict, Literal, Optional, Set, TypedDict
+from cachetools import TTLCache
+from app.config import settings
+from app.services.conversation_service import conversation_service
+from app.middleware import ConversationNotFoundError
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TaskRecord(TypedDict):
+    """Stored state of one background chat task, as returned to pollers."""
+    task_id: str
+    status: Literal["pending", "completed", "failed"]
+    conversation_id: Optional[str]
+    result: Optional[Dict[str, Any]]
+    error: Optional[str]
+
+
+class TaskService:
+    """
+    Runs chat turns as background tasks and stores their outcome in memory.
+    
+    Tasks run on the event loop of the worker that accepted them, so with
+    several workers a poll has to reach the same worker (sticky sessions).
+    """
+    
+    def __init__(self):
+        # task_id -> TaskRecord
+        self._tasks: TTLCache = TTLCache(
+            maxsize=settings.task_store_size, ttl=settings.task_result_ttl_seconds
+        )
+        self._running: Set[asyncio.Task] = set()  # Keep references until each task finishes
+    
+    def submit(self, conversation_id: Optional[str], user_message: str) -> TaskRecord:
+        """
+        Schedule a chat turn and return its pending task record.
+        
+        Args:
+            conversation_id: ID of existing conversation, or None to start a new one
+            user_message: The user message
+            
+        Returns:
+            Copy of the task record with status "pending"
+        """
+        task_id = str(uuid.uuid4())
+        record: TaskRecord = {
+            "task_id": task_id,
+            "status": "pending",
+            "conversation_id": conversation_id,
+            "result": None,
+            "error": None
+        }
+        self._tasks[task_id] = record
+        task = asyncio.create_task(self._run(task_id, conversation_id, user_message))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return record.copy()
+    
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        """Return a copy of the task record, or None if unknown or expired."""
+        record: Optional[TaskRecord] = self._tasks.get(task_id)
+        return record.copy() if record is not None else None
+    
+    async def _run(self, task_id: str, conversation_id: Optional[str], user_message: str) -> None:
+        """Run the conversation pipeline and record its result or error."""
+        record: TaskRecord
+        try:
+            if conversation_id:
+                result = await conversation_service.continue_conversation(conversation_id, user_message)
+            else:
+                result = await conversation_service.start_new_conversation(user_message)
+            record = {
+                "task_id": task_id,
+                "status": "completed",
+                "conversation_id": result["conversation_id"],
+                "result": result,
+                "error": None
+            }
+        except ConversationNotFoundError:
+            record = self._failed(task_id, conversation_id, f"Conversation {conversation_id} not found")
+        except Exception as e:
+            logger.error("Background chat task %s failed: %s", task_id, e)
+            record = self._failed(task_id, conversation_id, "AI service temporarily unavailable")
+        # Re-inserting also restarts the TTL, so results stay pollable for the full period
+        self._tasks[task_id] = record
+    
+    @staticmethod
+    def _failed(task_id: str, conversation_id: Optional[str], error: str) -> TaskRecord:
+        """Record for a task whose pipeline raised."""
+        return {
+            "task_id": task_id,
+            "status": "failed",
+            "conversation_id": conversation_id,
+            "result": None,
+            "error": error
+        }
+
+
+# Global task service instance
+task_service = TaskService()
@@ -4,66 +4,69 @@ Provides emergency responses that maintain controversial positions.
 """
 
 import random
-from typing import Dict, List, Any
+from types import MappingProxyType
+from typing import Dict, List, Any, Mapping, Tuple
+
+
+# Templates are built once at import time; positions and topics are filled
+# in with str.format so each fallback is a single pass over the template.
+_POSITION_TEMPLATES: Tuple[str, ...] = (
+    "[ERROR] I maintain that {position}.",
+    "[ERROR] That's a common counterargument, but {position}.",
+    "[ERROR] I understand your perspective, however {position}."
+)
+
+# Generic responses for unknown topics
+_GENERIC_FALLBACKS: Tuple[str, ...] = (
+    "[ERROR] I disagree with that perspective. Have you considered the arguments that support the opposite view?",
+    "[ERROR] That's one way to look at it, but I think there's stronger evidence for the contrary position.",
+    "[ERROR] I understand that's a common opinion, but I believe the evidence points in a different direction.",
+    "[ERROR] That argument has some merit, but I think you're overlooking key factors that support my position.",
+    "[ERROR] I see why people think that, but I maintain there are better reasons to believe the opposite."
+)
+
+_TECHNICAL_ERROR_TEMPLATES: Tuple[str, ...] = (
+    "[ERROR] Technical issue occurred, but my position on {topic} remains valid.",
+    "[ERROR] Sorry for the interruption. My argument about {topic} stands.",
+    "[ERROR] Technical glitch aside, my position on {topic} has solid foundations."
+)
+
+_FALLBACK_TEMPLATES: Mapping[str, Tuple[str, ...]] = MappingProxyType({
+    "position": _POSITION_TEMPLATES,
+    "generic": _GENERIC_FALLBACKS,
+    "technical": _TECHNICAL_ERROR_TEMPLATES,
+})
 
 
 class FallbackResponseGenerator:
     """Generates fallback responses when AI chains fail."""
     
-    def __init__(self):
-        # No predefined controversial topics - use dynamic responses based on bot position
-        
-        # Generic responses for unknown topics
-        self.generic_fallbacks = [
-            "I disagree with that perspective. Have you considered the arguments that support the opposite view?",
-            "That's one way to look at it, but I think there's stronger evidence for the contrary position.",
-            "I understand that's a common opinion, but I believe the evidence points in a different direction.",
-            "That argument has some merit, but I think you're overlooking key factors that support my position.",
-            "I see why people think that, but I maintain there are better reasons to believe the opposite."
-        ]
+    # Stateless: no predefined controversial topics, every response is built
+    # from the module-level templates and the bot position
     
-    def get_fallback_response(self, category: str = "Other", topic: str = "", position: str = "", user_message: str = "") -> str:
+    @staticmethod
+    def get_fallback_response(category: str = "Other", topic: str = "", position: str = "", user_message: str = "") -> str:
         """Get a fallback response based on bot position and user language."""
         
         # Use bot position if available, otherwise use generic responses
         if position:
             # Simple English fallbacks - let main LLM handle language detection
-            templates = [
-                f"[ERROR] I maintain that {position.lower()}.",
-                f"[ERROR] That's a common counterargument, but {position.lower()}.",
-                f"[ERROR] I understand your perspective, however {position.lower()}."
-            ]
-            return random.choice(templates)
+            return FallbackResponseGenerator.get_position_maintenance_response(position)
         
         # Generic fallbacks when no position is available
-        response = random.choice(self.generic_fallbacks)
-        response = f"[ERROR] {response}"
-            
-        if topic:
-            response = response.replace("this", topic.lower()).replace("esto", topic.lower())
-        
-        return response
+        return random.choice(_FALLBACK_TEMPLATES["generic"])
     
-    def get_technical_error_response(self, topic: str = "this topic", user_message: str = "") -> str:
+    @staticmethod
+    def get_technical_error_response(topic: str = "this topic", user_message: str = "") -> str:
         """Get response for technical errors while maintaining debate."""
         
         # Simple English responses - let main LLM handle language detection
-        responses = [
-            f"[ERROR] Technical issue occurred, but my position on {topic} remains valid.",
-            f"[ERROR] Sorry for the interruption. My argument about {topic} stands.",
-            f"[ERROR] Technical glitch aside, my position on {topic} has solid foundations."
-        ]
-        return random.choice(responses)
+        return random.choice(_FALLBACK_TEMPLATES["technical"]).format(topic=topic)
     
-    def get_position_maintenance_response(self, position: str, user_message: str = "") -> str:
+    @staticmethod
+    def get_position_maintenance_response(position: str, user_message: str = "") -> str:
         """Generate response that maintains position when other methods fail."""
-        templates = [
-            f"[ERROR] I maintain that {position.lower()}.",
-            f"[ERROR] That's a common counterargument, but {position.lower()}.",
-            f"[ERROR] I understand your perspective, however {position.lower()}."
-        ]
-        
-        return random.choice(templates)
+        return random.choice(_FALLBACK_TEMPLATES["position"]).format(position=position.lower())
 
 
 class ErrorResponseGenerator:
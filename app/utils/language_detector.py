@@ -3,35 +3,43 @@ Hybrid language detection utility for determining user language from messages.
 Combines fast manual detection with LLM fallback for ambiguous cases.
 """
 
-from typing import Dict, Any, Tuple
+import re
+from typing import FrozenSet, Tuple
 import logging
 
 
+# Indicator words, matched against whole tokens of the message
+SPANISH_INDICATORS: FrozenSet[str] = frozenset({
+    "qué", "cómo", "por", "para", "con", "sin", "muy", "más", "menos",
+    "también", "sí", "no", "es", "son", "está", "están", "el", "la",
+    "los", "las", "de", "del", "al", "en", "un", "una", "y", "o",
+    "pero", "que", "se", "me", "te", "le", "nos", "os", "les", "mi",
+    "tu", "su", "este", "esta", "estos", "estas", "todo", "todos",
+    "hacer", "tener", "ser", "estar", "ir", "venir", "ver", "dar",
+    "carne", "papa", "comida", "casa", "trabajo", "vida", "tiempo",
+    "bueno", "malo", "grande", "pequeño", "nuevo", "viejo", "primero"
+})
+
+ENGLISH_INDICATORS: FrozenSet[str] = frozenset({
+    "the", "and", "or", "but", "is", "are", "was", "were", "have",
+    "has", "had", "do", "does", "did", "will", "would", "could",
+    "should", "can", "may", "might", "must", "shall", "this", "that",
+    "these", "those", "what", "when", "where", "why", "how", "who",
+    "which", "better", "best", "good", "bad", "like", "love", "want",
+    "need", "think", "know", "see", "look", "come", "go", "get",
+    "make", "take", "give", "work", "time", "life", "home", "food",
+    "about", "after", "again", "against", "all", "any", "because"
+})
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
 class HybridLanguageDetector:
     """Hybrid language detection utility with manual + LLM fallback."""
     
     def __init__(self):
-        self.spanish_indicators = [
-            "qué", "cómo", "por", "para", "con", "sin", "muy", "más", "menos", 
-            "también", "sí", "no", "es", "son", "está", "están", "el", "la", 
-            "los", "las", "de", "del", "al", "en", "un", "una", "y", "o", 
-            "pero", "que", "se", "me", "te", "le", "nos", "os", "les", "mi", 
-            "tu", "su", "este", "esta", "estos", "estas", "todo", "todos", 
-            "hacer", "tener", "ser", "estar", "ir", "venir", "ver", "dar",
-            "carne", "papa", "comida", "casa", "trabajo", "vida", "tiempo",
-            "bueno", "malo", "grande", "pequeño", "nuevo", "viejo", "primero"
-        ]
-        
-        self.english_indicators = [
-            "the", "and", "or", "but", "is", "are", "was", "were", "have", 
-            "has", "had", "do", "does", "did", "will", "would", "could", 
-            "should", "can", "may", "might", "must", "shall", "this", "that", 
-            "these", "those", "what", "when", "where", "why", "how", "who", 
-            "which", "better", "best", "good", "bad", "like", "love", "want", 
-            "need", "think", "know", "see", "look", "come", "go", "get", 
-            "make", "take", "give", "work", "time", "life", "home", "food",
-            "about", "after", "again", "against", "all", "any", "because"
-        ]
+        self.spanish_indicators = SPANISH_INDICATORS
+        self.english_indicators = ENGLISH_INDICATORS
         
         self.confidence_threshold = 0.7
         self.logger = logging.getLogger(__name__)
@@ -46,15 +54,16 @@ class HybridLanguageDetector:
         if not text:
             return "English", 0.5
         
-        text_lower = text.lower()
-        words = text_lower.split()
+        # Tokenize once and intersect with the indicator sets
+        words = _WORD_PATTERN.findall(text.lower())
         total_words = len(words)
         
         if total_words == 0:
             return "English", 0.5
         
-        spanish_matches = sum(1 for word in self.spanish_indicators if word in text_lower)
-        english_matches = sum(1 for word in self.english_indicators if word in text_lower)
+        tokens = set(words)
+        spanish_matches = len(tokens & self.spanish_indicators)
+        english_matches = len(tokens & self.english_indicators)
         
         # Calculate confidence based on matches and text length
         total_matches = spanish_matches + english_matches
@@ -112,11 +121,11 @@ Language:"""
                 return "English"
             else:
                 # Fallback if LLM gives unexpected response
-                self.logger.warning(f"Unexpected LLM language detection response: {result}")
+                self.logger.warning("Unexpected LLM language detection response: %s", result)
                 return "English"
                 
         except Exception as e:
-            self.logger.error(f"LLM language detection failed: {e}")
+            self.logger.error("LLM language detection failed: %s", e)
             return "English"  # Fallback to English
     
     def detect_language(self, text: str) -> str:
@@ -135,16 +144,16 @@ Language:"""
         # Step 1: Try manual detection
         language, confidence = self._manual_detection(text)
         
-        self.logger.debug(f"Manual detection: {language} (confidence: {confidence:.2f})")
+        self.logger.debug("Manual detection: %s (confidence: %.2f)", language, confidence)
         
         # Step 2: Use LLM if confidence is low
         if confidence >= self.confidence_threshold:
-            self.logger.debug(f"High confidence manual detection: {language}")
+            self.logger.debug("High confidence manual detection: %s", language)
             return language
         else:
-            self.logger.debug(f"Low confidence, using LLM fallback")
+            self.logger.debug("Low confidence, using LLM fallback")
             llm_result = self._llm_detection(text)
-            self.logger.debug(f"LLM detection result: {llm_result}")
+            self.logger.debug("LLM detection result: %s", llm_result)
             return llm_result
     
     def get_language_code(self, text: str) -> str:
@@ -6,6 +6,23 @@ Implements validation logic for response quality and consistency.
 import re
 from typing import List, Dict, Any, Tuple
 
+# Phrase lists are built once at import. Plain substring checks are kept on
+# purpose: for lists this short, str.__contains__ outruns a regex alternation.
+_INAPPROPRIATE_PHRASES = (
+    "i'm sorry", "i apologize", "you're absolutely right",
+    "i agree completely", "that's correct", "you make a good point",
+    "i was wrong", "i change my mind"
+)
+_GENERIC_PHRASES = ("i don't know", "maybe", "perhaps", "it depends")
+_CONVERSATION_ENDERS = (
+    "end of discussion", "nothing more to say", "that's final",
+    "case closed", "end of story"
+)
+_CONTRADICTION_PHRASES = (
+    "actually, you're right", "i was wrong about", "let me reconsider",
+    "that changes everything", "i agree with you"
+)
+
 
 class ResponseValidator:
     """Validates bot responses for quality and consistency."""
@@ -19,15 +36,18 @@ class ResponseValidator:
     
     def validate_response_length(self, response: str) -> Tuple[bool, List[str]]:
         """Validate response length constraints."""
+        return self._check_length(len(response.strip()), len(response.split()))
+    
+    def _check_length(self, char_count: int, word_count: int) -> Tuple[bool, List[str]]:
+        """Length checks on precomputed character and word counts."""
         issues = []
         
-        if len(response.strip()) < self.min_length:
+        if char_count < self.min_length:
             issues.append(f"Response too short (minimum {self.min_length} characters)")
         
-        if len(response.strip()) > self.max_length:
+        if char_count > self.max_length:
             issues.append(f"Response too long (maximum {self.max_length} characters)")
         
-        word_count = len(response.split())
         if word_count < self.min_words:
             issues.append(f"Response has too few words (minimum {self.min_words})")
         
@@ -38,23 +58,20 @@ class ResponseValidator:
     
     def validate_response_content(self, response: str, position: str) -> Tuple[bool, List[str]]:
         """Validate response content for appropriateness and consistency."""
+        return self._check_content(response.lower())
+    
+    @staticmethod
+    def _check_content(response_lower: str) -> Tuple[bool, List[str]]:
+        """Content checks on the already lowercased response."""
         issues = []
-        response_lower = response.lower()
         
         # Check for inappropriate content
-        inappropriate_phrases = [
-            "i'm sorry", "i apologize", "you're absolutely right", 
-            "i agree completely", "that's correct", "you make a good point",
-            "i was wrong", "i change my mind"
-        ]
-        
-        for phrase in inappropriate_phrases:
+        for phrase in _INAPPROPRIATE_PHRASES:
             if phrase in response_lower:
                 issues.append(f"Response contains inappropriate agreement: '{phrase}'")
         
         # Check for empty or generic responses
-        generic_phrases = ["i don't know", "maybe", "perhaps", "it depends"]
-        if any(phrase in response_lower for phrase in generic_phrases):
+        if any(phrase in response_lower for phrase in _GENERIC_PHRASES):
             issues.append("Response is too generic or uncertain")
         
         # Removed strict elaboration check - any response that maintains position is valid
@@ -63,48 +80,65 @@ class ResponseValidator:
     
     def validate_debate_engagement(self, response: str) -> Tuple[bool, List[str]]:
         """Validate that response encourages continued debate."""
+        return self._check_engagement(response.lower())
+    
+    @staticmethod
+    def _check_engagement(response_lower: str) -> Tuple[bool, List[str]]:
+        """Engagement checks on the already lowercased response."""
         issues = []
-        response_lower = response.lower()
         
         # Removed engagement requirements - bot just needs to maintain position
         # Check for conversation enders
-        conversation_enders = [
-            "end of discussion", "nothing more to say", "that's final",
-            "case closed", "end of story"
-        ]
-        
-        if any(ender in response_lower for ender in conversation_enders):
+        if any(ender in response_lower for ender in _CONVERSATION_ENDERS):
             issues.append("Response contains conversation-ending phrases")
         
         return len(issues) == 0, issues
     
-    def comprehensive_validation(self, response: str, position: str) -> Dict[str, Any]:
-        """Perform comprehensive validation of a bot response."""
-        all_issues = []
+    def comprehensive_validation(self, response: str, position: str, fail_fast: bool = False) -> Dict[str, Any]:
+        """
+        Perform comprehensive validation of a bot response.
+        
+        With fail_fast, checks stop at the first failing category and the
+        categories that were not reached are reported as None.
+        """
+        all_issues: List[str] = []
+        
+        # Derive the strings and counts once and share them with every check
+        char_count = len(response.strip())
+        word_count = len(response.split())
+        response_lower = response.lower()
+        
+        result = {
+            "is_valid": False,
+            "issues": all_issues,
+            "length_valid": None,
+            "content_valid": None,
+            "engagement_valid": None,
+            "word_count": word_count,
+            "char_count": char_count
+        }
         
         # Length validation
-        length_valid, length_issues = self.validate_response_length(response)
+        length_valid, length_issues = self._check_length(char_count, word_count)
         all_issues.extend(length_issues)
+        result["length_valid"] = length_valid
+        if fail_fast and not length_valid:
+            return result
         
         # Content validation
-        content_valid, content_issues = self.validate_response_content(response, position)
+        content_valid, content_issues = self._check_content(response_lower)
         all_issues.extend(content_issues)
+        result["content_valid"] = content_valid
+        if fail_fast and not content_valid:
+            return result
         
         # Engagement validation
-        engagement_valid, engagement_issues = self.validate_debate_engagement(response)
+        engagement_valid, engagement_issues = self._check_engagement(response_lower)
         all_issues.extend(engagement_issues)
+        result["engagement_valid"] = engagement_valid
         
-        overall_valid = length_valid and content_valid and engagement_valid
-        
-        return {
-            "is_valid": overall_valid,
-            "issues": all_issues,
-            "length_valid": length_valid,
-            "content_valid": content_valid,
-            "engagement_valid": engagement_valid,
-            "word_count": len(response.split()),
-            "char_count": len(response.strip())
-        }
+        result["is_valid"] = length_valid and content_valid and engagement_valid
+        return result
 
 
 class ConversationValidator:
@@ -160,12 +194,7 @@ class ConversationValidator:
             content = msg.get("message", "").lower()
             
             # Check if bot is contradicting its position
-            contradiction_phrases = [
-                "actually, you're right", "i was wrong about", "let me reconsider",
-                "that changes everything", "i agree with you"
-            ]
-            
-            if any(phrase in content for phrase in contradiction_phrases):
+            if any(phrase in content for phrase in _CONTRADICTION_PHRASES):
                 issues.append(f"Bot message {i+1} contains potential contradiction")
         
         return len(issues) == 0, issues
@@ -3,74 +3,56 @@ Unit tests for FastAPI endpoints.
 Tests API functionality, validation, and error handling.
 """
 
+import asyncio
+import httpx
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from app.main import app
 from app.models.schemas import ChatRequest, ChatResponse
 
 
-client = TestClient(app)
+@pytest.fixture(scope="session")
+def client():
+    """Shared test client; lifespan is not entered so no API key check goes out."""
+    yield TestClient(app)
 
 
 class TestChatEndpoint:
     """Test /chat endpoint functionality."""
     
-    @patch('app.services.conversation_service.start_new_conversation')
-    def test_new_conversation_success(self, mock_start):
-        """Test successful new conversation creation."""
-        mock_start.return_value = {
-            "conversation_id": "test-123",
-            "messages": [
-                {"turn": 1, "role": "user", "message": "Hello"},
-                {"turn": 1, "role": "bot", "message": "Hi there"}
-            ],
-            "conversation_history": [
-                {"turn": 1, "role": "user", "message": "Hello"},
-                {"turn": 1, "role": "bot", "message": "Hi there"}
-            ]
-        }
+    @pytest.mark.parametrize("conversation_id, mock_target, expected_history_len", [
+        (None, "start_new_conversation", 2),
+        ("test-123", "continue_conversation", 4),
+    ])
+    def test_chat_success(self, client, conversation_id, mock_target, expected_history_len):
+        """Test successful conversation creation and continuation."""
+        turn = expected_history_len // 2
+        history = [
+            {"turn": t, "role": role, "message": f"{role} message {t}"}
+            for t in range(1, turn + 1)
+            for role in ("user", "bot")
+        ]
         
-        response = client.post("/chat", json={
-            "conversation_id": None,
-            "message": "Hello"
-        })
-        
-        assert response.status_code == 200
-        data = response.json()
-        assert data["conversation_id"] == "test-123"
-        assert len(data["messages"]) == 2
-        assert len(data["conversation_history"]) == 2
-    
-    @patch('app.services.conversation_service.continue_conversation')
-    def test_continue_conversation_success(self, mock_continue):
-        """Test successful conversation continuation."""
-        mock_continue.return_value = {
-            "conversation_id": "test-123",
-            "messages": [
-                {"turn": 2, "role": "user", "message": "How are you?"},
-                {"turn": 2, "role": "bot", "message": "I'm doing well"}
-            ],
-            "conversation_history": [
-                {"turn": 1, "role": "user", "message": "Hello"},
-                {"turn": 1, "role": "bot", "message": "Hi there"},
-                {"turn": 2, "role": "user", "message": "How are you?"},
-                {"turn": 2, "role": "bot", "message": "I'm doing well"}
-            ]
-        }
-        
-        response = client.post("/chat", json={
-            "conversation_id": "test-123",
-            "message": "How are you?"
-        })
+        with patch(f'app.main.conversation_service.{mock_target}', new_callable=AsyncMock) as mock_service:
+            mock_service.return_value = {
+                "conversation_id": "test-123",
+                "messages": history[-2:],
+                "conversation_history": history
+            }
+            
+            response = client.post("/chat", json={
+                "conversation_id": conversation_id,
+                "message": "user message"
+            })
         
         assert response.status_code == 200
         data = response.json()
         assert data["conversation_id"] == "test-123"
         assert len(data["messages"]) == 2
-        assert len(data["conversation_history"]) == 4
+        assert len(data["conversation_history"]) == expected_history_len
     
-    def test_missing_message_field(self):
+    def test_missing_message_field(self, client):
         """Test request with missing message field."""
         response = client.post("/chat", json={
             "conversation_id": "test-123"
@@ -78,7 +60,7 @@ class TestChatEndpoint:
         
         assert response.status_code == 422  # Validation error
     
-    def test_empty_message_rejected(self):
+    def test_empty_message_rejected(self, client):
         """Test request with empty message."""
         response = client.post("/chat", json={
             "conversation_id": "test-123",
@@ -87,7 +69,7 @@ class TestChatEndpoint:
         
         assert response.status_code == 422  # Validation error
     
-    def test_extra_fields_rejected(self):
+    def test_extra_fields_rejected(self, client):
         """Test request with extra fields."""
         response = client.post("/chat", json={
             "conversation_id": "test-123",
@@ -100,7 +82,7 @@ class TestChatEndpoint:
         assert data["error"] == "Invalid request format"
         assert "Only 'conversation_id' and 'message' attributes are allowed" in data["message"]
     
-    def test_message_too_long_rejected(self):
+    def test_message_too_long_rejected(self, client):
         """Test request with message exceeding length limit."""
         long_message = "a" * 6000
         response = client.post("/chat", json={
@@ -110,8 +92,8 @@ class TestChatEndpoint:
         
         assert response.status_code == 422  # Validation error
     
-    @patch('app.services.conversation_service.continue_conversation')
-    def test_conversation_not_found(self, mock_continue):
+    @patch('app.main.conversation_service.continue_conversation', new_callable=AsyncMock)
+    def test_conversation_not_found(self, mock_continue, client):
         """Test conversation not found error."""
         from app.middleware import ConversationNotFoundError
         mock_continue.side_effect = ConversationNotFoundError("Conversation not found")
@@ -123,8 +105,8 @@ class TestChatEndpoint:
         
         assert response.status_code == 404
     
-    @patch('app.services.conversation_service.start_new_conversation')
-    def test_ai_service_error(self, mock_start):
+    @patch('app.main.conversation_service.start_new_conversation', new_callable=AsyncMock)
+    def test_ai_service_error(self, mock_start, client):
         """Test AI service error handling."""
         from app.middleware import AIServiceError
         mock_start.side_effect = AIServiceError("AI service failed")
@@ -137,10 +119,78 @@ class TestChatEndpoint:
         assert response.status_code == 503
 
 
+class TestChatStreamEndpoint:
+    """Test /chat/stream endpoint functionality."""
+    
+    @patch('app.main.conversation_service.stream_conversation', new_callable=AsyncMock)
+    def test_stream_emits_sse_events(self, mock_stream, client):
+        """Test the reply is streamed as start, token and done events."""
+        async def chunks():
+            for chunk in ["Hello", " there"]:
+                yield chunk
+        
+        mock_stream.return_value = ("test-123", chunks())
+        
+        response = client.post("/chat/stream", json={
+            "conversation_id": None,
+            "message": "Hello"
+        })
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = response.text
+        assert body.startswith('event: start\ndata: {"conversation_id":"test-123"}')
+        assert body.count("event: token") == 2
+        assert '"message":"Hello there"' in body
+    
+    @patch('app.main.conversation_service.stream_conversation', new_callable=AsyncMock)
+    def test_stream_conversation_not_found(self, mock_stream, client):
+        """Test unknown conversation is rejected before streaming starts."""
+        from app.middleware import ConversationNotFoundError
+        mock_stream.side_effect = ConversationNotFoundError("Not found")
+        
+        response = client.post("/chat/stream", json={
+            "conversation_id": "nonexistent",
+            "message": "Hello"
+        })
+        
+        assert response.status_code == 404
+
+
+class TestChatTaskEndpoint:
+    """Test /chat?mode=async and /chat/tasks polling."""
+    
+    @patch('app.main.task_service.submit')
+    def test_async_mode_returns_task(self, mock_submit, client):
+        """Test async mode answers 202 with a pending task instead of the reply."""
+        mock_submit.return_value = {
+            "task_id": "task-1",
+            "status": "pending",
+            "conversation_id": "test-123",
+            "result": None,
+            "error": None
+        }
+        
+        response = client.post("/chat?mode=async", json={
+            "conversation_id": "test-123",
+            "message": "Hello"
+        })
+        
+        assert response.status_code == 202
+        assert response.json()["task_id"] == "task-1"
+        mock_submit.assert_called_once_with("test-123", "Hello")
+    
+    def test_unknown_task_not_found(self, client):
+        """Test polling an unknown task returns 404."""
+        response = client.get("/chat/tasks/nonexistent")
+        
+        assert response.status_code == 404
+
+
 class TestHealthEndpoint:
     """Test /health endpoint functionality."""
     
-    def test_health_check_success(self):
+    def test_health_check_success(self, client):
         """Test successful health check."""
         response = client.get("/health")
         
@@ -154,7 +204,7 @@ class TestHealthEndpoint:
 class TestRootEndpoint:
     """Test root endpoint functionality."""
     
-    def test_root_endpoint(self):
+    def test_root_endpoint(self, client):
         """Test root endpoint returns basic info."""
         response = client.get("/")
         
@@ -169,8 +219,9 @@ class TestRootEndpoint:
 class TestRateLimiting:
     """Test rate limiting functionality."""
     
-    @patch('app.services.conversation_service.start_new_conversation')
-    def test_rate_limit_exceeded(self, mock_start):
+    @patch('app.main.conversation_service.start_new_conversation', new_callable=AsyncMock)
+    @pytest.mark.asyncio
+    async def test_rate_limit_exceeded(self, mock_start):
         """Test rate limiting with many requests."""
         mock_start.return_value = {
             "conversation_id": "test-123",
@@ -178,14 +229,16 @@ class TestRateLimiting:
             "conversation_history": []
         }
         
-        # Make many requests quickly
-        responses = []
-        for i in range(105):  # Exceed 100 per minute limit
-            response = client.post("/chat", json={
-                "conversation_id": None,
-                "message": f"Hello {i}"
-            })
-            responses.append(response)
+        # Make many requests at once instead of one after another
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as async_client:
+            responses = await asyncio.gather(*(
+                async_client.post("/chat", json={
+                    "conversation_id": None,
+                    "message": f"Hello {i}"
+                })
+                for i in range(105)  # Exceed 100 per minute limit
+            ))
         
         # Some requests should be rate limited
         rate_limited = [r for r in responses if r.status_code == 429]
@@ -196,17 +249,69 @@ class TestRateLimiting:
             data = rate_limited[0].json()
             assert data["error"] == "Rate limit exceeded"
             assert "retry_after" in data
+    
+    @patch('app.middleware.rate_limiter.time.monotonic_ns')
+    def test_token_bucket_refills_over_time(self, mock_monotonic_ns):
+        """Test that a drained bucket recovers at the configured rate."""
+        from app.middleware.rate_limiter import RateLimiter, NS_PER_SECOND
+        
+        limiter = RateLimiter(max_requests=2, window_seconds=60)
+        mock_monotonic_ns.return_value = 1000 * NS_PER_SECOND
+        
+        assert limiter.is_allowed("1.2.3.4") == (True, None)
+        assert limiter.is_allowed("1.2.3.4") == (True, None)
+        allowed, retry_after = limiter.is_allowed("1.2.3.4")
+        assert allowed is False
+        assert retry_after == 31
+        
+        # One token refills every 30 seconds
+        mock_monotonic_ns.return_value = 1030 * NS_PER_SECOND
+        assert limiter.is_allowed("1.2.3.4") == (True, None)
+    
+    @patch('app.middleware.rate_limiter.time.monotonic_ns')
+    def test_sliding_window_expires_old_sub_windows(self, mock_monotonic_ns):
+        """Test that requests count until their sub-window leaves the window."""
+        from app.middleware.rate_limiter import SlidingWindowRateLimiter, NS_PER_SECOND
+        
+        limiter = SlidingWindowRateLimiter(max_requests=2, window_seconds=60, sub_windows=6)
+        mock_monotonic_ns.return_value = 1005 * NS_PER_SECOND
+        assert limiter.is_allowed("1.2.3.4") == (True, None)
+        
+        mock_monotonic_ns.return_value = 1031 * NS_PER_SECOND
+        assert limiter.is_allowed("1.2.3.4") == (True, None)
+        allowed, retry_after = limiter.is_allowed("1.2.3.4")
+        assert allowed is False
+        assert retry_after == 30  # First request's sub-window [1000, 1010) leaves at 1060
+        
+        mock_monotonic_ns.return_value = 1060 * NS_PER_SECOND
+        assert limiter.is_allowed("1.2.3.4") == (True, None)
+    
+    @pytest.mark.asyncio
+    async def test_throttled_requests_trigger_cleanup(self):
+        """Test rejected requests still advance the cleanup counter."""
+        from app.middleware.rate_limiter import RateLimitMiddleware, CLEANUP_INTERVAL_REQUESTS
+        
+        limiter = MagicMock()
+        limiter.is_allowed.return_value = (False, 30)
+        middleware = RateLimitMiddleware(AsyncMock(), rate_limiter=limiter)
+        scope = {"type": "http", "path": "/chat", "headers": [], "client": ("1.2.3.4", 1234)}
+        
+        for _ in range(CLEANUP_INTERVAL_REQUESTS):
+            await middleware(scope, AsyncMock(), AsyncMock())
+        
+        middleware.app.assert_not_called()
+        limiter.cleanup_old_entries.assert_called_once()
 
 
 class TestSwaggerDocs:
     """Test Swagger documentation endpoints."""
     
-    def test_swagger_docs_accessible(self):
+    def test_swagger_docs_accessible(self, client):
         """Test that Swagger docs are accessible."""
         response = client.get("/docs")
         assert response.status_code == 200
     
-    def test_openapi_json_accessible(self):
+    def test_openapi_json_accessible(self, client):
         """Test that OpenAPI JSON is accessible."""
         response = client.get("/openapi.json")
         assert response.status_code == 200
@@ -4,39 +4,61 @@ Tests SQLAlchemy models and database manager functionality.
 """
 
 import pytest
-import tempfile
-import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, update
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from app.models.database import Base, Conversation, Message, DatabaseManager
+from app.middleware import DatabaseError
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """In-memory database whose schema is created once per test run."""
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    
+    # pysqlite's own transaction handling breaks SAVEPOINT; let SQLAlchemy emit BEGIN
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+    
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def connection(engine):
+    """Connection inside an outer transaction that is rolled back after each test."""
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        yield connection
+        transaction.rollback()
+
+
+def _savepoint_sessionmaker(connection, **kwargs):
+    """Sessions whose commits release a SAVEPOINT instead of ending the outer transaction."""
+    return sessionmaker(bind=connection, join_transaction_mode="create_savepoint", **kwargs)
 
 
 class TestDatabaseModels:
     """Test SQLAlchemy model functionality."""
     
-    @pytest.fixture
-    def temp_db(self):
-        """Create temporary database for testing."""
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
-        temp_file.close()
-        
-        engine = create_engine(f"sqlite:///{temp_file.name}")
-        Base.metadata.create_all(bind=engine)
-        
-        yield temp_file.name
-        
-        os.unlink(temp_file.name)
-    
-    def test_conversation_model(self, temp_db):
+    def test_conversation_model(self, connection):
         """Test Conversation model creation and relationships."""
-        engine = create_engine(f"sqlite:///{temp_db}")
-        Session = sessionmaker(bind=engine)
+        Session = _savepoint_sessionmaker(connection, expire_on_commit=False)
         
         with Session() as session:
             conversation = Conversation(
                 id="test-123",
                 topic="Climate Change",
                 bot_position="Climate change is natural",
+                original_topic="Is climate change natural?",
                 max_turns=2
             )
             session.add(conversation)
@@ -48,17 +70,17 @@ class TestDatabaseModels:
             assert retrieved.bot_position == "Climate change is natural"
             assert retrieved.max_turns == 2
     
-    def test_message_model(self, temp_db):
+    def test_message_model(self, connection):
         """Test Message model creation and validation."""
-        engine = create_engine(f"sqlite:///{temp_db}")
-        Session = sessionmaker(bind=engine)
+        Session = _savepoint_sessionmaker(connection, expire_on_commit=False)
         
         with Session() as session:
             # Create conversation first
             conversation = Conversation(
                 id="test-123",
                 topic="Test Topic",
-                bot_position="Test position"
+                bot_position="Test position",
+                original_topic="Test message"
             )
             session.add(conversation)
             session.commit()
@@ -94,31 +116,23 @@ class TestDatabaseManager:
     """Test DatabaseManager functionality."""
     
     @pytest.fixture
-    def db_manager(self):
-        """Create temporary database manager for testing."""
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
-        temp_file.close()
-        
-        # Mock settings for testing
-        class MockSettings:
-            database_url = f"sqlite:///{temp_file.name}"
-            log_level = "INFO"
-        
-        # Create manager with temp database
-        manager = DatabaseManager()
-        manager.engine = create_engine(MockSettings.database_url)
-        manager.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=manager.engine)
-        manager.create_tables()
+    def db_manager(self, engine, request):
+        """Database manager bound to the shared in-memory database for testing."""
+        # Built before the per-test transaction opens; create_tables needs the connection
+        manager = DatabaseManager(engine)
+        connection = request.getfixturevalue("connection")
+        manager.SessionLocal = _savepoint_sessionmaker(
+            connection, autocommit=False, autoflush=False, expire_on_commit=False
+        )
         
         yield manager
-        
-        os.unlink(temp_file.name)
     
     def test_create_conversation(self, db_manager):
         """Test conversation creation."""
         conversation_id = db_manager.create_conversation(
             topic="Test Topic",
-            bot_position="Test Position"
+            bot_position="Test Position",
+            original_topic="Test message"
         )
         
         assert conversation_id is not None
@@ -139,7 +153,7 @@ class TestDatabaseManager:
     def test_add_message(self, db_manager):
         """Test adding messages to conversation."""
         # Create conversation
-        conversation_id = db_manager.create_conversation("Test", "Position")
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
         
         # Add user message
         success = db_manager.add_message(conversation_id, 1, "user", "Hello")
@@ -153,15 +167,57 @@ class TestDatabaseManager:
         conversation = db_manager.get_conversation(conversation_id)
         assert conversation["max_turns"] == 1
     
+    def test_add_messages(self, db_manager):
+        """Test storing a whole turn in one call."""
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
+        
+        success = db_manager.add_messages(conversation_id, [(1, "user", "Hello"), (1, "bot", "Hi there")])
+        assert success is True
+        
+        history = db_manager.get_conversation_history(conversation_id)
+        assert [msg["role"] for msg in history] == ["user", "bot"]
+        assert db_manager.get_conversation(conversation_id)["max_turns"] == 1
+        assert db_manager.get_next_turn(conversation_id) == 2
+    
+    def test_add_messages_failure_raises(self, db_manager):
+        """Test a failed turn write raises and stores none of its rows."""
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
+        
+        with pytest.raises(DatabaseError):
+            db_manager.add_messages(conversation_id, [(1, "user", "Hello"), (1, "narrator", "Hi there")])
+        
+        assert db_manager.get_conversation_history(conversation_id) == []
+        assert db_manager.get_next_turn(conversation_id) == 1
+    
+    def test_get_conversation_cached_row_tracks_turns(self, db_manager):
+        """Test a cached conversation still reports turns written elsewhere and is returned as a copy."""
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
+        
+        conversation = db_manager.get_conversation(conversation_id)
+        conversation["topic"] = "Changed"
+        
+        # Another process stores turn 2 without going through this manager
+        with db_manager.get_session() as session:
+            session.execute(
+                update(Conversation).where(Conversation.id == conversation_id).values(max_turns=2)
+            )
+            session.commit()
+        
+        conversation = db_manager.get_conversation(conversation_id)
+        assert conversation["topic"] == "Test"
+        assert conversation["max_turns"] == 2
+    
     def test_get_conversation_history(self, db_manager):
         """Test retrieving conversation history."""
         # Create conversation and add messages
-        conversation_id = db_manager.create_conversation("Test", "Position")
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
         
-        db_manager.add_message(conversation_id, 1, "user", "Hello")
-        db_manager.add_message(conversation_id, 1, "bot", "Hi")
-        db_manager.add_message(conversation_id, 2, "user", "How are you?")
-        db_manager.add_message(conversation_id, 2, "bot", "Good")
+        db_manager.add_messages(conversation_id, [
+            (1, "user", "Hello"),
+            (1, "bot", "Hi"),
+            (2, "user", "How are you?"),
+            (2, "bot", "Good")
+        ])
         
         # Get history
         history = db_manager.get_conversation_history(conversation_id)
@@ -177,11 +233,13 @@ class TestDatabaseManager:
     def test_get_current_turn_messages(self, db_manager):
         """Test retrieving messages for specific turn."""
         # Create conversation and add messages
-        conversation_id = db_manager.create_conversation("Test", "Position")
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
         
-        db_manager.add_message(conversation_id, 1, "user", "Hello")
-        db_manager.add_message(conversation_id, 1, "bot", "Hi")
-        db_manager.add_message(conversation_id, 2, "user", "How are you?")
+        db_manager.add_messages(conversation_id, [
+            (1, "user", "Hello"),
+            (1, "bot", "Hi"),
+            (2, "user", "How are you?")
+        ])
         
         # Get turn 1 messages
         turn_1_messages = db_manager.get_current_turn_messages(conversation_id, 1)
@@ -193,7 +251,7 @@ class TestDatabaseManager:
     def test_get_next_turn(self, db_manager):
         """Test getting next turn number."""
         # Create conversation
-        conversation_id = db_manager.create_conversation("Test", "Position")
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
         
         # Should start at turn 1
         next_turn = db_manager.get_next_turn(conversation_id)
@@ -207,13 +265,27 @@ class TestDatabaseManager:
         next_turn = db_manager.get_next_turn(conversation_id)
         assert next_turn == 2
     
+    def test_get_next_turn_sees_other_writers(self, db_manager):
+        """Test turn numbering follows max_turns written by another worker."""
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
+        db_manager.get_conversation(conversation_id)
+        
+        # Another process finishes turn 3 without going through this manager
+        with db_manager.get_session() as session:
+            session.execute(
+                update(Conversation).where(Conversation.id == conversation_id).values(max_turns=3)
+            )
+            session.commit()
+        
+        assert db_manager.get_next_turn(conversation_id) == 4
+    
     def test_conversation_exists(self, db_manager):
         """Test conversation existence check."""
         # Non-existent conversation
         assert db_manager.conversation_exists("nonexistent") is False
         
         # Create conversation
-        conversation_id = db_manager.create_conversation("Test", "Position")
+        conversation_id = db_manager.create_conversation("Test", "Position", "Original")
         
         # Should now exist
         assert db_manager.conversation_exists(conversation_id) is True
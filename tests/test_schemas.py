@@ -8,6 +8,13 @@ from pydantic import ValidationError
 from app.models.schemas import ChatRequest, ChatResponse, MessageSchema, ErrorResponse, HealthResponse
 
 
+# Validated once at import; nested model instances are not revalidated when reused
+_MSG_USER = MessageSchema(turn=1, role="user", message="Hello")
+_MSG_BOT = MessageSchema(turn=1, role="bot", message="Hi there")
+
+_LONG_MSG = "a" * 6000  # Exceeds 5000 char limit
+
+
 class TestChatRequest:
     """Test ChatRequest schema validation."""
     
@@ -37,45 +44,16 @@ class TestChatRequest:
         )
         assert request.conversation_id is None
     
-    def test_message_required(self):
-        """Test that message is required."""
-        with pytest.raises(ValidationError) as exc_info:
-            ChatRequest(conversation_id="test")
-        
-        errors = exc_info.value.errors()
-        assert any(error['type'] == 'missing' for error in errors)
-    
-    def test_empty_message_rejected(self):
-        """Test that empty message is rejected."""
-        with pytest.raises(ValidationError):
-            ChatRequest(
-                conversation_id="test",
-                message=""
-            )
-    
-    def test_message_too_long_rejected(self):
-        """Test that messages exceeding max length are rejected."""
-        long_message = "a" * 6000  # Exceeds 5000 char limit
-        with pytest.raises(ValidationError) as exc_info:
-            ChatRequest(
-                conversation_id="test",
-                message=long_message
-            )
-        
-        errors = exc_info.value.errors()
-        assert any("exceeds maximum length" in str(error) for error in errors)
-    
-    def test_extra_fields_forbidden(self):
-        """Test that extra fields are forbidden."""
-        with pytest.raises(ValidationError) as exc_info:
-            ChatRequest(
-                conversation_id="test",
-                message="hello",
-                extra_field="not allowed"
-            )
-        
-        errors = exc_info.value.errors()
-        assert any(error['type'] == 'extra_forbidden' for error in errors)
+    @pytest.mark.parametrize("kwargs, match", [
+        ({"conversation_id": "test"}, "type=missing"),
+        ({"conversation_id": "test", "message": ""}, None),
+        ({"conversation_id": "test", "message": _LONG_MSG}, "exceeds maximum length"),
+        ({"conversation_id": "test", "message": "hello", "extra_field": "not allowed"}, "type=extra_forbidden"),
+    ], ids=["message_required", "empty_message", "message_too_long", "extra_fields_forbidden"])
+    def test_invalid_request_rejected(self, kwargs, match):
+        """Test that missing, empty, oversized messages and extra fields are rejected."""
+        with pytest.raises(ValidationError, match=match):
+            ChatRequest(**kwargs)
     
     def test_message_whitespace_stripped(self):
         """Test that message whitespace is stripped."""
@@ -102,15 +80,12 @@ class TestMessageSchema:
     
     def test_invalid_role_rejected(self):
         """Test that invalid roles are rejected."""
-        with pytest.raises(ValidationError) as exc_info:
+        with pytest.raises(ValidationError, match="Role must be 'user' or 'bot'"):
             MessageSchema(
                 turn=1,
                 role="invalid",
                 message="Hello"
             )
-        
-        errors = exc_info.value.errors()
-        assert any("Role must be 'user' or 'bot'" in str(error) for error in errors)
 
 
 class TestChatResponse:
@@ -120,14 +95,8 @@ class TestChatResponse:
         """Test valid chat response."""
         response = ChatResponse(
             conversation_id="test-123",
-            messages=[
-                MessageSchema(turn=1, role="user", message="Hello"),
-                MessageSchema(turn=1, role="bot", message="Hi there")
-            ],
-            conversation_history=[
-                MessageSchema(turn=1, role="user", message="Hello"),
-                MessageSchema(turn=1, role="bot", message="Hi there")
-            ]
+            messages=[_MSG_USER, _MSG_BOT],
+            conversation_history=[_MSG_USER, _MSG_BOT]
         )
         assert response.conversation_id == "test-123"
         assert len(response.messages) == 2
@@ -3,12 +3,43 @@ Unit tests for service layer functionality.
 Tests conversation service and retry service.
 """
 
+import asyncio
+import importlib
+import httpx
+import openai
 import pytest
-from unittest.mock import patch, MagicMock
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
 from app.services.conversation_service import ConversationService
-from app.services.retry_service import OpenAIClientManager
+from app.services.retry_service import OpenAIClientManager, RetryService
+from app.services.task_service import TaskService
 from app.middleware import ConversationNotFoundError, AIServiceError
 
+_BOT_REPLY = "I believe climate change is primarily natural."
+
+# First turn of an existing conversation, as the database returns it
+_TURN1 = (
+    {"turn": 1, "role": "user", "message": "Hello"},
+    {"turn": 1, "role": "bot", "message": "Hi there"}
+)
+
+# app.services re-exports the service instance under the module's name
+conversation_module = importlib.import_module("app.services.conversation_service")
+
+
+def _returns(value):
+    """Coroutine function standing in for an async chain or service method."""
+    async def call(*args, **kwargs):
+        return value
+    return call
+
+
+def _raises(error):
+    """Coroutine function that fails with error."""
+    async def call(*args, **kwargs):
+        raise error
+    return call
+
 
 class TestConversationService:
     """Test ConversationService functionality."""
@@ -18,108 +49,170 @@ class TestConversationService:
         """Create ConversationService instance for testing."""
         return ConversationService()
     
-    @patch('app.services.conversation_service.db_manager')
-    @patch('app.services.conversation_service.topic_analysis_chain')
-    @patch('app.services.conversation_service.position_assignment_chain')
-    @patch('app.services.conversation_service.persuasive_response_chain')
-    @patch('app.services.conversation_service.consistency_validation_chain')
-    def test_start_new_conversation_success(self, mock_validation, mock_response, 
-                                          mock_position, mock_topic, mock_db, service):
-        """Test successful new conversation creation."""
-        # Mock chain responses
-        mock_topic.analyze_topic.return_value = {
+    @pytest.fixture
+    def happy_chains(self, service):
+        """Chains that analyze, answer and approve without calling an LLM."""
+        service.topic_analysis = SimpleNamespace(analyze_topic=_returns({
             "topic": "Climate Change",
-            "category": "Climate Change",
-            "description": "Climate debate"
-        }
-        mock_position.assign_position.return_value = "Climate change is natural"
-        mock_response.generate_response.return_value = "I believe climate change is primarily natural."
-        mock_validation.validate_response.return_value = {
-            "is_consistent": True,
-            "is_persuasive": True,
-            "is_appropriate": True,
-            "overall_score": 8
-        }
-        
-        # Mock database operations
-        mock_db.create_conversation.return_value = "test-123"
-        mock_db.add_message.return_value = True
-        mock_db.get_current_turn_messages.return_value = [
-            {"turn": 1, "role": "user", "message": "Hello"},
-            {"turn": 1, "role": "bot", "message": "I believe climate change is primarily natural."}
-        ]
-        mock_db.get_conversation_history.return_value = [
-            {"turn": 1, "role": "user", "message": "Hello"},
-            {"turn": 1, "role": "bot", "message": "I believe climate change is primarily natural."}
-        ]
+            "bot_position": "Climate change is natural"
+        }))
+        service.persuasive_response = SimpleNamespace(generate_checked_response=_returns({
+            "response": _BOT_REPLY,
+            "consistency_score": 8,
+            "approved": True
+        }))
+        service.consistency_validation = SimpleNamespace(validate_batch=_returns([]))
+        return service
+    
+    @pytest.fixture
+    def conversation_db(self, monkeypatch):
+        """Fake database holding one conversation; returns the (conversation_id, rows) it stored."""
+        stored = []
         
-        result = service.start_new_conversation("Hello")
+        def add_messages(conversation_id, rows):
+            stored.append((conversation_id, rows))
+            return True
         
-        assert result["conversation_id"] == "test-123"
-        assert len(result["messages"]) == 2
-        assert len(result["conversation_history"]) == 2
+        monkeypatch.setattr(conversation_module, "db_manager", SimpleNamespace(
+            create_conversation=lambda **kwargs: "test-123",
+            get_conversation=lambda conversation_id: {
+                "id": "test-123",
+                "topic": "Climate Change",
+                "bot_position": "Climate change is natural",
+                "original_topic": "Hello",
+                "max_turns": 1
+            },
+            get_conversation_history=lambda conversation_id: list(_TURN1),
+            add_messages=add_messages
+        ))
+        return stored
     
-    @patch('app.services.conversation_service.db_manager')
-    def test_continue_conversation_not_found(self, mock_db, service):
-        """Test continuing non-existent conversation."""
-        mock_db.get_conversation.return_value = None
+    @pytest.mark.asyncio
+    async def test_start_returns_conversation_id(self, happy_chains, conversation_db):
+        """Test the new conversation's ID is returned and used to store the first turn."""
+        result = await happy_chains.start_new_conversation("Hello")
         
-        with pytest.raises(ConversationNotFoundError):
-            service.continue_conversation("nonexistent", "Hello")
-    
-    @patch('app.services.conversation_service.db_manager')
-    @patch('app.services.conversation_service.persuasive_response_chain')
-    @patch('app.services.conversation_service.consistency_validation_chain')
-    def test_continue_conversation_success(self, mock_validation, mock_response, mock_db, service):
-        """Test successful conversation continuation."""
-        # Mock existing conversation
-        mock_db.get_conversation.return_value = {
-            "id": "test-123",
-            "topic": "Climate Change",
-            "bot_position": "Climate change is natural"
-        }
-        mock_db.get_next_turn.return_value = 2
-        mock_db.get_conversation_history.return_value = [
-            {"turn": 1, "role": "user", "message": "Hello"},
-            {"turn": 1, "role": "bot", "message": "Hi there"}
-        ]
+        assert result["conversation_id"] == "test-123"
+        assert conversation_db == [("test-123", [(1, "user", "Hello"), (1, "bot", _BOT_REPLY)])]
+    
+    @pytest.mark.asyncio
+    async def test_start_returns_current_turn_messages(self, happy_chains, conversation_db):
+        """Test the first turn is returned as both the messages and the history."""
+        result = await happy_chains.start_new_conversation("Hello")
         
-        # Mock response generation
-        mock_response.generate_response.return_value = "Natural cycles explain climate variations."
-        mock_validation.validate_response.return_value = {
-            "is_consistent": True,
-            "is_persuasive": True,
-            "is_appropriate": True,
-            "overall_score": 8
-        }
-        
-        # Mock database operations
-        mock_db.add_message.return_value = True
-        mock_db.get_current_turn_messages.return_value = [
-            {"turn": 2, "role": "user", "message": "Tell me more"},
-            {"turn": 2, "role": "bot", "message": "Natural cycles explain climate variations."}
-        ]
-        mock_db.get_conversation_history.return_value = [
+        expected = [
             {"turn": 1, "role": "user", "message": "Hello"},
-            {"turn": 1, "role": "bot", "message": "Hi there"},
-            {"turn": 2, "role": "user", "message": "Tell me more"},
-            {"turn": 2, "role": "bot", "message": "Natural cycles explain climate variations."}
+            {"turn": 1, "role": "bot", "message": _BOT_REPLY}
         ]
+        assert result["messages"] == expected
+        assert result["conversation_history"] == expected
+    
+    @pytest.mark.asyncio
+    async def test_continue_conversation_not_found(self, service, monkeypatch):
+        """Test continuing non-existent conversation."""
+        monkeypatch.setattr(conversation_module, "db_manager", SimpleNamespace(
+            get_conversation=lambda conversation_id: None
+        ))
         
-        result = service.continue_conversation("test-123", "Tell me more")
+        with pytest.raises(ConversationNotFoundError):
+            await service.continue_conversation("nonexistent", "Hello")
+    
+    @pytest.mark.asyncio
+    async def test_continue_appends_turn_to_history(self, happy_chains, conversation_db):
+        """Test a later turn returns its two messages appended to the earlier history."""
+        result = await happy_chains.continue_conversation("test-123", "Tell me more")
         
         assert result["conversation_id"] == "test-123"
         assert len(result["messages"]) == 2
-        assert len(result["conversation_history"]) == 4
+        assert result["conversation_history"] == list(_TURN1) + result["messages"]
+    
+    @pytest.mark.asyncio
+    async def test_stream_stores_turn_after_reply(self, happy_chains, conversation_db):
+        """Test a streamed turn is stored in one write once the reply is complete."""
+        async def astream_response(**kwargs):
+            for chunk in ("I believe ", "it is natural."):
+                yield chunk
+        
+        happy_chains.persuasive_response = SimpleNamespace(astream_response=astream_response)
+        conversation_id, chunks = await happy_chains.stream_conversation("test-123", "Tell me more")
+        assert conversation_db == []
+        
+        assert [chunk async for chunk in chunks] == ["I believe ", "it is natural."]
+        assert conversation_db == [
+            (conversation_id, [(2, "user", "Tell me more"), (2, "bot", "I believe it is natural.")])
+        ]
     
-    @patch('app.services.conversation_service.db_manager')
-    @patch('app.services.conversation_service.topic_analysis_chain')
-    def test_start_conversation_chain_error(self, mock_topic, mock_db, service):
+    @pytest.mark.asyncio
+    async def test_start_conversation_chain_error(self, service, monkeypatch):
         """Test handling of chain errors during conversation start."""
-        mock_topic.analyze_topic.side_effect = Exception("Chain error")
+        service.topic_analysis = SimpleNamespace(analyze_topic=_raises(Exception("Chain error")))
+        monkeypatch.setattr(conversation_module, "db_manager", SimpleNamespace())
         
         with pytest.raises(AIServiceError):
-            service.start_new_conversation("Hello")
+            await service.start_new_conversation("Hello")
+    
+    @pytest.mark.asyncio
+    async def test_confident_positions_use_one_attempt(self, happy_chains):
+        """Test a position that keeps passing validation stops being retried."""
+        verdict = {"response": _BOT_REPLY, "consistency_score": 8, "approved": True}
+        calls = []
+        
+        async def generate_checked_response(**kwargs):
+            calls.append(kwargs["bot_position"])
+            return dict(verdict)
+        
+        happy_chains.persuasive_response = SimpleNamespace(
+            generate_checked_response=generate_checked_response
+        )
+        position = "Climate change is natural"
+        assert happy_chains._attempts_for(position) == happy_chains.max_validation_attempts
+        
+        # Each conversation on this position passes on the first try
+        for _ in range(20):
+            await happy_chains._generate_response(
+                "Hello", position=position, topic_data={"topic": "Weather"}
+            )
+        assert happy_chains._attempts_for(position) == 1
+        
+        # A failing reply now goes straight to the fallback instead of retrying
+        calls.clear()
+        verdict["approved"] = False
+        await happy_chains._generate_response(
+            "Hello", position=position, topic_data={"topic": "Climate"}
+        )
+        assert len(calls) == 1
+        assert happy_chains._attempts_for(position) == happy_chains.max_validation_attempts
+
+
+_OPENAI_REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _rate_limit_error(headers=None):
+    """Build a RateLimitError carrying a real 429 response."""
+    response = httpx.Response(429, headers=headers or {}, request=_OPENAI_REQUEST)
+    return openai.RateLimitError("Rate limit", response=response, body=None)
+
+
+# (error, retried) pairs, built once for the whole session
+_RETRY_CASES = [
+    (_rate_limit_error({"retry-after": "0"}), True),
+    (openai.APIConnectionError(message="Connection failed", request=_OPENAI_REQUEST), True),
+    (openai.AuthenticationError(
+        "Invalid API key", response=httpx.Response(401, request=_OPENAI_REQUEST), body=None
+    ), False),
+    (Exception("Generic error"), False),
+]
+
+
+_OK_RESPONSE = SimpleNamespace(
+    choices=[SimpleNamespace(message=SimpleNamespace(content="Test response"))],
+    usage=SimpleNamespace(prompt_tokens=10, prompt_tokens_details=None)
+)
+
+
+def _fake_client(create):
+    """AsyncOpenAI stand-in whose chat.completions.create is the given coroutine function."""
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
 
 
 class TestOpenAIClientManager:
@@ -130,100 +223,121 @@ class TestOpenAIClientManager:
         """Create OpenAIClientManager instance for testing."""
         return OpenAIClientManager()
     
-    @patch('app.services.retry_service.openai.OpenAI')
-    def test_safe_call_success(self, mock_openai_class, client_manager):
+    @pytest.fixture(autouse=True)
+    def _no_sleep(self, monkeypatch):
+        """Skip retry backoff waits so retry loops run at CPU speed."""
+        async def no_sleep(delay, *args, **kwargs):
+            return None
+        monkeypatch.setattr("asyncio.sleep", no_sleep)
+    
+    @pytest.mark.asyncio
+    async def test_chat_completion_success(self, client_manager):
         """Test successful API call with retry logic."""
-        # Mock successful response
-        mock_client = MagicMock()
-        mock_openai_class.return_value = mock_client
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock()]
-        mock_response.choices[0].message.content = "Test response"
-        
-        def mock_create(**kwargs):
-            return mock_response
-        
-        mock_client.chat.completions.create = mock_create
-        
-        # Test safe call
-        result = client_manager.safe_call(
-            mock_client.chat.completions.create,
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": "Hello"}]
+        client_manager.client = _fake_client(_returns(_OK_RESPONSE))
+        
+        result = await client_manager.chat_completion(
+            messages=[{"role": "user", "content": "Hello"}],
+            model="gpt-3.5-turbo"
         )
         
-        assert result == mock_response
+        assert result == ("Test response", True)
     
-    @patch('app.services.retry_service.openai.OpenAI')
-    def test_safe_call_retry_on_rate_limit(self, mock_openai_class, client_manager):
+    @pytest.mark.asyncio
+    async def test_chat_completion_retry_on_rate_limit(self, client_manager):
         """Test retry logic on rate limit errors."""
-        import openai
-        
-        mock_client = MagicMock()
-        mock_openai_class.return_value = mock_client
-        
-        # Mock rate limit error then success
-        call_count = 0
-        def mock_create(**kwargs):
-            nonlocal call_count
-            call_count += 1
-            if call_count == 1:
-                raise openai.RateLimitError("Rate limit exceeded", response=None, body=None)
-            else:
-                mock_response = MagicMock()
-                mock_response.choices = [MagicMock()]
-                mock_response.choices[0].message.content = "Success"
-                return mock_response
-        
-        mock_client.chat.completions.create = mock_create
+        # Rate limit error (with a zero Retry-After) then success
+        create = AsyncMock(side_effect=[_rate_limit_error({"retry-after": "0"}), _OK_RESPONSE])
+        client_manager.client = _fake_client(create)
         
         # Should succeed after retry
-        result = client_manager.safe_call(
-            mock_client.chat.completions.create,
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": "Hello"}]
+        result = await client_manager.chat_completion(
+            messages=[{"role": "user", "content": "Hello"}],
+            model="gpt-3.5-turbo"
         )
         
-        assert call_count == 2  # One failure, one success
+        assert result == ("Test response", True)
+        assert create.call_count == 2  # One failure, one success
     
-    @patch('app.services.retry_service.openai.OpenAI')
-    def test_safe_call_max_retries_exceeded(self, mock_openai_class, client_manager):
+    @pytest.mark.asyncio
+    async def test_chat_completion_max_retries_exceeded(self, client_manager, monkeypatch):
         """Test behavior when max retries are exceeded."""
-        import openai
-        
-        mock_client = MagicMock()
-        mock_openai_class.return_value = mock_client
+        # A small budget is enough to prove the loop gives up
+        monkeypatch.setattr(client_manager.retry_service, "max_retries", 2)
         
-        # Always fail with rate limit error
-        def mock_create(**kwargs):
-            raise openai.RateLimitError("Rate limit exceeded", response=None, body=None)
+        # Always fail with a rate limit error that carries no Retry-After
+        create = AsyncMock(side_effect=_rate_limit_error())
+        client_manager.client = _fake_client(create)
         
-        mock_client.chat.completions.create = mock_create
+        # Should give up after max retries and report failure
+        result = await client_manager.chat_completion(
+            messages=[{"role": "user", "content": "Hello"}],
+            model="gpt-3.5-turbo"
+        )
         
-        # Should raise exception after max retries
-        with pytest.raises(Exception):
-            client_manager.safe_call(
-                mock_client.chat.completions.create,
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": "Hello"}]
-            )
+        assert result == (None, False)
+        assert create.call_count == client_manager.retry_service.max_retries
     
-    def test_is_retryable_error(self, client_manager):
+    @pytest.mark.parametrize("error, retried", _RETRY_CASES, ids=["rate_limit", "connection", "authentication", "generic"])
+    @pytest.mark.asyncio
+    async def test_is_retryable_error(self, client_manager, error, retried):
         """Test retryable error detection."""
-        import openai
+        func = AsyncMock(side_effect=error)
         
-        # Rate limit errors should be retryable
-        rate_limit_error = openai.RateLimitError("Rate limit", response=None, body=None)
-        assert client_manager.is_retryable_error(rate_limit_error) is True
+        with pytest.raises(type(error)):
+            await client_manager.retry_service.call_openai_with_retry(func)
+        
+        # Retryable errors use every attempt, the rest fail immediately
+        expected_calls = client_manager.retry_service.max_retries if retried else 1
+        assert func.call_count == expected_calls
+
+
+class TestTaskService:
+    """Test TaskService background chat tasks."""
+    
+    @patch('app.services.task_service.conversation_service')
+    @pytest.mark.asyncio
+    async def test_task_completes_with_result(self, mock_service):
+        """Test a submitted turn is pending until the pipeline finishes."""
+        result = {"conversation_id": "test-123", "messages": [], "conversation_history": []}
+        mock_service.start_new_conversation = AsyncMock(return_value=result)
+        tasks = TaskService()
         
-        # API connection errors should be retryable
-        api_error = openai.APIConnectionError("Connection failed")
-        assert client_manager.is_retryable_error(api_error) is True
+        record = tasks.submit(None, "Hello")
+        assert record["status"] == "pending"
+        
+        await asyncio.gather(*tasks._running)
+        
+        completed = tasks.get(record["task_id"])
+        assert completed["status"] == "completed"
+        assert completed["conversation_id"] == "test-123"
+        assert completed["result"] == result
+    
+    @patch('app.services.task_service.conversation_service')
+    @pytest.mark.asyncio
+    async def test_task_failure_is_recorded(self, mock_service):
+        """Test pipeline errors end the task as failed instead of propagating."""
+        mock_service.continue_conversation = AsyncMock(side_effect=AIServiceError("boom"))
+        tasks = TaskService()
+        
+        record = tasks.submit("test-123", "Hello")
+        await asyncio.gather(*tasks._running)
+        
+        failed = tasks.get(record["task_id"])
+        assert failed["status"] == "failed"
+        assert failed["error"] == "AI service temporarily unavailable"
+
+
+class TestRetryService:
+    """Test RetryService retry policy."""
+    
+    @pytest.mark.asyncio
+    async def test_retry_honors_retry_after(self):
+        """Test rate limited calls wait for the server's Retry-After delay."""
+        func = AsyncMock(side_effect=[_rate_limit_error({"retry-after": "2"}), "ok"])
         
-        # Authentication errors should not be retryable
-        auth_error = openai.AuthenticationError("Invalid API key", response=None, body=None)
-        assert client_manager.is_retryable_error(auth_error) is False
+        with patch("asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+            result = await RetryService().call_openai_with_retry(func)
         
-        # Generic exceptions should not be retryable
-        generic_error = Exception("Generic error")
-        assert client_manager.is_retryable_error(generic_error) is False
+        assert result == "ok"
+        assert func.call_count == 2
+        mock_sleep.assert_awaited_once_with(2.0)
@@ -0,0 +1,40 @@
+"""
+Unit tests for utility helpers.
+Tests manual language detection against whole-word indicators.
+"""
+
+import pytest
+from app.utils.language_detector import HybridLanguageDetector
+
+
+class TestManualLanguageDetection:
+    """Test HybridLanguageDetector's word-list heuristic."""
+    
+    @pytest.fixture
+    def detector(self):
+        """Create HybridLanguageDetector instance for testing."""
+        return HybridLanguageDetector()
+    
+    @pytest.mark.parametrize("text, language", [
+        ("¿Qué es mejor para la vida, el trabajo o la casa?", "Spanish"),
+        ("What is the best food and why do you like it?", "English"),
+    ], ids=["spanish", "english"])
+    def test_clear_text_is_confident(self, detector, text, language):
+        """Test sentences full of indicator words clear the confidence threshold."""
+        detected, confidence = detector._manual_detection(text)
+        
+        assert detected == language
+        assert confidence >= detector.confidence_threshold
+    
+    def test_prefixes_of_spanish_words_do_not_match(self, detector):
+        """Test English words sharing a prefix with Spanish indicators are not counted as Spanish."""
+        detected, confidence = detector._manual_detection("Primary grants establish estimates")
+        
+        # No whole-word hits either way: low confidence, so the LLM fallback decides
+        assert (detected, confidence) == ("English", 0.3)
+    
+    def test_indicators_inside_words_do_not_match(self, detector):
+        """Test a Spanish indicator inside a longer word ("no" in "know") is ignored."""
+        detected, _ = detector._manual_detection("I know")
+        
+        assert detected == "English"